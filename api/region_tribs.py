@@ -1,13 +1,326 @@
-from flask import Flask, request, jsonify
-from pypdf import PdfReader
+from flask import Flask, Request, g, request, jsonify, stream_with_context
+from werkzeug.wsgi import wrap_file
 from datetime import datetime
 import random
 from tools.foo import RandomNumberGenerator
-from tools.region_tribs_tools import AnnotationsExtractor, AreaElementAnalyzer
-from werkzeug.utils import secure_filename
+from tools.region_tribs_settings import (ANALYZER_VERSION, BATCH_CONCURRENCY, BATCH_MAX_BYTES,
+                                         JOB_LEASE_SECONDS, JOB_RETENTION_SECONDS, PARALLEL_WORKERS,
+                                         PROFILES, SPOOL_THRESHOLD_BYTES)
+from tools.result_cache import ResultCache
+from tools.result_json import dumps, loads
+from tools.instrumentation import (MemoryLimitExceeded, count, current_timer, log_request, metrics,
+                                   request_logger, stage, start_request_timer, use_timer)
+import gzip
+import json
+import logging
 import os
+import shutil
+import tempfile
+import threading
+import zipfile
+import zlib
+
+
+class SpooledUploadRequest(Request):
+    """
+    Keeps uploaded files in memory up to SPOOL_THRESHOLD_BYTES and only spools larger
+    uploads to a temporary file, so PdfReader reads the upload buffer directly.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=SPOOL_THRESHOLD_BYTES)
+
 
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
+
+# Analysis results keyed by upload hash. Set REGION_TRIBS_CACHE_DIR (e.g. /tmp/region_tribs_cache)
+# to also keep results on disk for the lifetime of the instance.
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get('REGION_TRIBS_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    disk_dir=os.environ.get('REGION_TRIBS_CACHE_DIR'),
+    disk_max_bytes=int(os.environ.get('REGION_TRIBS_CACHE_DISK_MAX_BYTES', 256 * 1024 * 1024)))
+
+# Per-page extraction and analysis state of documents processed with incremental=1, keyed by
+# the result token handed to the client. REGION_TRIBS_SESSION_DIR adds an on-disk layer.
+analysis_sessions = ResultCache(
+    max_bytes=int(os.environ.get('REGION_TRIBS_SESSION_MAX_BYTES', 64 * 1024 * 1024)),
+    disk_dir=os.environ.get('REGION_TRIBS_SESSION_DIR'),
+    disk_max_bytes=int(os.environ.get('REGION_TRIBS_SESSION_DISK_MAX_BYTES', 256 * 1024 * 1024)))
+
+# Background jobs for drawing sets that don't finish within a request. REGION_TRIBS_JOB_STORE is
+# a store URL (sqlite:///path/to/jobs.db or file:///path/to/directory). With the default "thread"
+# runner jobs run in a thread of this process; "external" leaves them to python -m tools.job_worker.
+# The store is created by the first job request, see get_job_store.
+job_store = None
+job_store_lock = threading.Lock()
+app.config['JOB_RUNNER'] = os.environ.get('REGION_TRIBS_JOB_RUNNER', 'thread')
+
+# Uploads above REGION_TRIBS_MAX_UPLOAD_BYTES are rejected with a 413 before being read
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('REGION_TRIBS_MAX_UPLOAD_BYTES', 0)) or None
+
+# Bounded-memory processing for every process_pdf request, rather than only for bounded=1 ones
+app.config['BOUNDED_MEMORY'] = os.environ.get('REGION_TRIBS_BOUNDED_MEMORY', '0') == '1'
+
+# GET /api/region_tribs/metrics serves the in-process latency histograms when enabled
+app.config['METRICS_ENDPOINT'] = os.environ.get('REGION_TRIBS_METRICS_ENDPOINT', '0') == '1'
+
+# One structured JSON log record per request
+request_logger.setLevel(logging.INFO)
+if not request_logger.handlers:
+    request_logger.addHandler(logging.StreamHandler())
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Smaller payloads aren't worth compressing
+GZIP_MIN_BYTES = 1024
+
+
+def request_flag(name):
+    return request.values.get(name, 'false').lower() in ('1', 'true', 'yes')
+
+
+def get_job_store():
+    global job_store
+    with job_store_lock:
+        if job_store is None:
+            from tools.job_store import make_job_store
+
+            job_store = make_job_store(os.environ.get(
+                'REGION_TRIBS_JOB_STORE', os.path.join(tempfile.gettempdir(), 'region_tribs_jobs')),
+                JOB_LEASE_SECONDS)
+        return job_store
+
+
+def resume_abandoned_job(store, job):
+    # with the thread runner nobody else picks up a job whose instance died; polling it does
+    if app.config['JOB_RUNNER'] == 'thread' and store.claimable(job):
+        from tools.job_worker import start_job_thread
+
+        start_job_thread(store, job['id'])
+
+
+def requested_workers():
+    # optional "workers" form field, capped by REGION_TRIBS_WORKERS (or the number of cores)
+    workers = request.form.get('workers', type=int)
+    if workers is None or workers < 1:
+        return None
+    return min(workers, PARALLEL_WORKERS or os.cpu_count() or 1)
+
+
+def output_options():
+    # "profile" is one of result_formats.PROFILES, "precision" rounds coordinates to that
+    # many decimals and "sparse" drops zero totals and empty intersection lists
+    return {
+        'profile': request.values.get('profile', 'full'),
+        'precision': request.values.get('precision', type=int),
+        'sparse': request_flag('sparse')
+    }
+
+
+def bounded_memory():
+    return app.config['BOUNDED_MEMORY'] or request_flag('bounded')
+
+
+def json_payload_response(payload, cache_status):
+    response = app.response_class(payload, mimetype='application/json')
+    response.headers['X-Cache'] = cache_status
+    response.vary.add('Accept-Encoding')
+    if len(payload) >= GZIP_MIN_BYTES and 'gzip' in request.accept_encodings:
+        with stage('compress'):
+            response.set_data(gzip.compress(payload, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def result_cache_key(pdf, options, pages=None):
+    # pdf is the upload stream or the PDF bytes
+    return ResultCache.make_key(pdf, '{}:{profile}:{precision}:{sparse}:{}'.format(
+        ANALYZER_VERSION, pages, **options))
+
+
+def skipped_header(skipped):
+    # {1-based page number: reason} as compact JSON, e.g. {"3":"no_annotations"}
+    return json.dumps(skipped, separators=(',', ':'))
+
+
+def cache_entry(payload, skipped):
+    # the skipped pages ride along on the first line; compact JSON never contains a newline
+    return skipped_header(skipped).encode() + b'\n' + payload
+
+
+def split_cache_entry(entry):
+    # returns the X-Skipped-Pages value and the payload
+    skipped, payload = entry.split(b'\n', 1)
+    return skipped.decode(), payload
+
+
+def read_batch_documents(files):
+    """
+    Return (name, pdf bytes or None, error or None) for each PDF of a batch upload, in upload
+    order. Zip archives are expanded into the PDFs they contain. Raises ValueError when the
+    PDFs add up to more than BATCH_MAX_BYTES.
+    """
+    documents = []
+    total_bytes = 0
+
+    def add(name, data, error=None):
+        nonlocal total_bytes
+        total_bytes += len(data or b'')
+        if total_bytes > BATCH_MAX_BYTES:
+            raise ValueError(f"Batch is larger than {BATCH_MAX_BYTES} bytes")
+        documents.append((name, data, error))
+
+    for file in files:
+        name = file.filename or ''
+        lower_name = name.lower()
+        if lower_name.endswith('.pdf'):
+            add(name, file.read())
+        elif lower_name.endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(file.stream)
+            except zipfile.BadZipFile as e:
+                add(name, None, str(e))
+                continue
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or info.filename.startswith('__MACOSX/') \
+                            or not info.filename.lower().endswith('.pdf'):
+                        continue
+                    # check the declared size before inflating anything
+                    if total_bytes + info.file_size > BATCH_MAX_BYTES:
+                        raise ValueError(f"Batch is larger than {BATCH_MAX_BYTES} bytes")
+                    try:
+                        data = archive.read(info)
+                    except (zipfile.BadZipFile, zlib.error, RuntimeError, EOFError) as e:
+                        # a corrupted or encrypted member fails on its own
+                        add(f'{name}/{info.filename}', None, str(e))
+                        continue
+                    add(f'{name}/{info.filename}', data)
+        else:
+            add(name, None, "Invalid file type")
+
+    # results are keyed by filename, so repeated names get a numeric suffix
+    seen = {}
+    unique = []
+    for name, data, error in documents:
+        seen[name] = seen.get(name, 0) + 1
+        unique.append((name if seen[name] == 1 else f'{name} ({seen[name]})', data, error))
+    return unique
+
+
+def batch_entry(skipped, payload):
+    # skipped is the X-Skipped-Pages value
+    return b'{"pages":' + payload + b',"skipped":' + skipped.encode() + b'}'
+
+
+def store_session(pages):
+    # pages holds {"page_data", "area_analysis"} per page, None for skipped pages.
+    # Returns None when the session is too large to keep, rather than a token that would 404.
+    payload = dumps(pages)
+    token = ResultCache.make_key(payload, ANALYZER_VERSION)
+    if not analysis_sessions.set(token, payload):
+        request_logger.warning("Session of %d bytes exceeds the session limits and was not kept", len(payload))
+        return None
+    return token
+
+
+def load_session(token):
+    payload = analysis_sessions.get(token)
+    return None if payload is None else loads(payload)
+
+
+def route_name():
+    return request.url_rule.rule if request.url_rule else request.path
+
+
+def record_request(timer, route, method, status):
+    log_request(timer, route=route, method=method, status=status)
+    metrics.observe_request(route, timer)
+
+
+@app.before_request
+def start_timing():
+    start_request_timer()
+
+
+@app.after_request
+def add_timing(response):
+    timer = current_timer()
+    if timer is None:
+        return response
+    response.headers['Server-Timing'] = timer.server_timing()
+    # streamed pages are recorded once the last page has been sent
+    if not g.get('record_after_stream'):
+        timer.sample_memory()
+        response.headers['X-Peak-RSS'] = str(timer.peak_rss)
+        record_request(timer, route_name(), request.method, response.status_code)
+    return response
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"error": f"Upload is larger than {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
+
+
+def iter_formatted_pages(extractor, page_numbers, options):
+    # one serialized page at a time, null for pages outside page_numbers
+    from tools.region_tribs_tools import iter_analyzed_pages
+    from tools.result_formats import format_page
+
+    analyzed = iter_analyzed_pages(extractor, page_numbers)
+    selected = set(page_numbers)
+    for page_number in range(extractor.get_number_of_pages()):
+        area_analysis = next(analyzed)[1] if page_number in selected else None
+        with stage('serialize'):
+            yield dumps(format_page(area_analysis, **options))
+
+
+def bounded_payload_response(extractor, page_numbers, options):
+    """
+    Analyze and serialize the pages one at a time into a spooled file, so that neither the page
+    objects nor the analysis results of earlier pages are kept, and send the file.
+    The body is gzipped while it is written when the client accepts it.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_THRESHOLD_BYTES)
+    try:
+        compress = 'gzip' in request.accept_encodings
+        output = gzip.GzipFile(fileobj=body, mode='wb', compresslevel=6) if compress else body
+        output.write(b'[')
+        for i, page in enumerate(iter_formatted_pages(extractor, page_numbers, options)):
+            output.write(b',' + page if i else page)
+        output.write(b']')
+        if compress:
+            output.close()
+        size = body.tell()
+        body.seek(0)
+    except BaseException:
+        body.close()
+        raise
+
+    response = app.response_class(wrap_file(request.environ, body), mimetype='application/json',
+                                  direct_passthrough=True)
+    response.content_length = size
+    response.headers['X-Cache'] = 'BYPASS'
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def generate_ndjson_pages(extractor, page_numbers, options, timer):
+    use_timer(timer)
+    route, method = route_name(), request.method
+    # each line is the page's area analysis, or null for pages that were skipped
+    try:
+        for page in iter_formatted_pages(extractor, page_numbers, options):
+            yield page + b'\n'
+    except Exception as e:
+        # the status code has already been sent, so report the failure in-band
+        yield dumps({"error": str(e)}) + b'\n'
+    finally:
+        extractor.close()
+        record_request(timer, route, method, 200)
 
 
 @app.route('/api/region_tribs/time')
@@ -23,6 +336,13 @@ def random_number():
     return jsonify({"random_number": number})
 
 
+@app.route('/api/region_tribs/metrics')
+def request_metrics():
+    if not app.config['METRICS_ENDPOINT']:
+        return jsonify({"error": "Metrics endpoint is disabled"}), 404
+    return jsonify(metrics.to_dict())
+
+
 @app.route('/api/region_tribs/upload-pdf', methods=['POST'])
 def upload_pdf():
     if 'file' not in request.files:
@@ -34,16 +354,11 @@ def upload_pdf():
 
     if file and file.filename.endswith('.pdf'):
         try:
-            reader = PdfReader(file)
-            metadata = reader.metadata
-            result = jsonify({
-                "author": metadata.author,
-                "creator": metadata.creator,
-                "producer": metadata.producer,
-                "subject": metadata.subject,
-                "title": metadata.title,
-                "number_of_pages": len(reader.pages)
-            })
+            # pypdf is only loaded by the routes that read PDFs
+            from tools.pdf_metadata import read_metadata
+
+            with stage('metadata'):
+                result = jsonify(read_metadata(file.stream, pages=False))
             print(result)
             return result
         except Exception as e:
@@ -53,40 +368,434 @@ def upload_pdf():
     return jsonify({"error": "Invalid file type"}), 400
 
 
+@app.route('/api/region_tribs/metadata', methods=['POST'])
+def pdf_metadata():
+    """
+    upload-pdf's document metadata plus, per page, the number of annotations, the number of A:
+    regions and whether the page has a SCALE line and weight criteria, without analyzing anything.
+    "summary_only" leaves out the pages.
+    """
+    with stage('upload'):
+        files = request.files
+    if 'file' not in files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = files['file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    if not file.filename.endswith('.pdf'):
+        return jsonify({"error": "Invalid file type"}), 400
+
+    try:
+        from tools.pdf_metadata import read_metadata
+
+        with stage('metadata'):
+            metadata = read_metadata(file.stream, pages=not request_flag('summary_only'))
+        return jsonify(metadata)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/api/region_tribs/process_pdf', methods=['POST'])
 def process_pdf():
-    if 'file' not in request.files:
+    # the multipart body is parsed on first access to request.files
+    with stage('upload'):
+        files = request.files
+    if 'file' not in files:
         return jsonify({"error": "No file part"}), 400
 
-    file = request.files['file']
+    file = files['file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
+    options = output_options()
+    if options['profile'] not in PROFILES:
+        return jsonify({"error": f"Unknown profile, expected one of {', '.join(PROFILES)}"}), 400
+
     if file and file.filename.endswith('.pdf'):
         try:
-            # Save the file temporarily
-            filename = secure_filename(file.filename)
-            temp_pdf_path = os.path.join('/tmp', filename)
-            file.save(temp_pdf_path)
-
-            # Process the PDF
-            extractor = AnnotationsExtractor(temp_pdf_path)
-            all_pages_data = []
-            for page_num in range(extractor.get_number_of_pages()):
-                page_data = extractor.extract_real_world_coordinates(page_num)
-                if page_data:
-                    analyzer = AreaElementAnalyzer(page_data)
-                    area_analysis = analyzer.calculate_intersection_lengths()
-                    all_pages_data.append(area_analysis)
-                else:
-                    all_pages_data.append(None)
+            # The PDF and geometry stack (pypdf, Shapely, NumPy) is loaded on first use
+            # so cold starts of the other routes don't pay for it
+            from tools.region_tribs_tools import (AnnotationsExtractor, PageSelectionError, process_pages,
+                                                select_pages)
+            from tools.result_formats import format_pages
+
+            # optional "pages" parameter, e.g. "1-3,7" or "10-"; other pages come back as null
+            pages = request.values.get('pages') or None
+
+            # Clients sending "Accept: application/x-ndjson" get one JSON line per page as soon
+            # as it has been analyzed. Streamed responses are not cached.
+            if request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+                # the upload is closed when the request ends, which can be before the
+                # response has finished streaming, so hand the extractor its own copy
+                stream = tempfile.SpooledTemporaryFile(max_size=SPOOL_THRESHOLD_BYTES)
+                file.stream.seek(0)
+                shutil.copyfileobj(file.stream, stream)
+                extractor = AnnotationsExtractor(stream)
+                extractor.owns_stream = True
+                try:
+                    page_numbers = select_pages(pages, extractor.get_number_of_pages())
+                except PageSelectionError:
+                    extractor.close()
+                    raise
+                skipped = extractor.screen_pages(page_numbers)
+                g.record_after_stream = True
+                response = app.response_class(stream_with_context(
+                    generate_ndjson_pages(extractor, page_numbers, options, current_timer())),
+                    mimetype=NDJSON_MIMETYPE)
+                response.headers['X-Cache'] = 'BYPASS'
+                response.headers['X-Skipped-Pages'] = skipped_header(skipped)
+                return response
+
+            # incremental=1 keeps each page's annotations and analysis on this instance and
+            # returns a token for /api/region_tribs/reanalyze in the X-Result-Token header
+            if request_flag('incremental'):
+                from tools.region_tribs_tools import SKIP_NO_REGIONS, iter_analyzed_pages
 
-            # Clean up: remove the temporary file
-            os.remove(temp_pdf_path)
+                with AnnotationsExtractor(file.stream) as extractor:
+                    session = [None] * extractor.get_number_of_pages()
+                    page_numbers = select_pages(pages, len(session))
+                    # pages with a SCALE line but no regions are still extracted, so that
+                    # regions can be added to them later, and aren't reported as skipped
+                    skipped = {page_number: reason
+                               for page_number, reason in extractor.screen_pages(page_numbers).items()
+                               if reason != SKIP_NO_REGIONS}
+                    page_data = {}
+                    for page_number, area_analysis in iter_analyzed_pages(
+                            extractor, page_numbers, page_data=page_data):
+                        if page_data[page_number]:
+                            session[page_number] = {'page_data': page_data[page_number],
+                                                    'area_analysis': area_analysis}
+                with stage('serialize'):
+                    token = store_session(session)
+                    payload = dumps(format_pages(
+                        [page and page['area_analysis'] for page in session], **options))
+                response = json_payload_response(payload, 'BYPASS')
+                if token:
+                    response.headers['X-Result-Token'] = token
+                response.headers['X-Skipped-Pages'] = skipped_header(skipped)
+                return response
 
-            return jsonify(all_pages_data)
+            # bounded=1 (or REGION_TRIBS_BOUNDED_MEMORY) runs the pages one at a time in this
+            # process and writes each one out before the next, for very large drawing sets.
+            # Results are not cached.
+            if bounded_memory():
+                with AnnotationsExtractor(file.stream) as extractor:
+                    page_numbers = select_pages(pages, extractor.get_number_of_pages())
+                    skipped = extractor.screen_pages(page_numbers)
+                    response = bounded_payload_response(extractor, page_numbers, options)
+                response.headers['X-Skipped-Pages'] = skipped_header(skipped)
+                return response
 
+            # Serve repeat uploads of the same drawing set from the cache
+            # "no_cache" query or form parameter skips the lookup and forces a fresh analysis
+            bypass_cache = request_flag('no_cache')
+            with stage('cache'):
+                cache_key = result_cache_key(file.stream, options, pages)
+                entry = None if bypass_cache else result_cache.get(cache_key)
+            if entry is not None:
+                skipped, payload = split_cache_entry(entry)
+                response = json_payload_response(payload, 'HIT')
+                response.headers['X-Skipped-Pages'] = skipped
+                return response
+
+            # Process the PDF straight from the upload stream
+            skipped = {}
+            all_pages_data = process_pages(file.stream, workers=requested_workers(), pages=pages,
+                                           skipped=skipped)
+
+            with stage('serialize'):
+                payload = dumps(format_pages(all_pages_data, **options))
+            result_cache.set(cache_key, cache_entry(payload, skipped))
+            response = json_payload_response(payload, 'BYPASS' if bypass_cache else 'MISS')
+            response.headers['X-Skipped-Pages'] = skipped_header(skipped)
+            return response
+
+        except PageSelectionError as e:
+            return jsonify({"error": str(e)}), 400
+        except MemoryLimitExceeded as e:
+            return jsonify({"error": str(e)}), 503
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
     return jsonify({"error": "Invalid file type"}), 400
+
+
+@app.route('/api/region_tribs/seismic_weights', methods=['POST'])
+def seismic_weights():
+    """
+    Effective seismic weight per tributary area, joined server-side from the analysis and each
+    page's weight criteria. "by" is "area" (default, one row per area with per element kind totals)
+    or "element" (one row per area and element label), "format" is json records (default), csv
+    or parquet. Takes process_pdf's "pages", "workers" and "no_cache".
+    """
+    with stage('upload'):
+        files = request.files
+    if 'file' not in files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = files['file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    if not file.filename.endswith('.pdf'):
+        return jsonify({"error": "Invalid file type"}), 400
+
+    by = request.values.get('by', 'area')
+    output_format = request.values.get('format', 'json')
+    pages = request.values.get('pages') or None
+
+    try:
+        from tools.region_tribs_tools import PageSelectionError, process_pages
+        from tools.seismic_weights import FORMATS, MIMETYPES, parquet_available, serialize
+        from tools.seismic_weights import seismic_weights as weights_table
+
+        if by not in ('area', 'element') or output_format not in FORMATS:
+            return jsonify({"error": f"Expected by=area|element and format={'|'.join(FORMATS)}"}), 400
+        if output_format == 'parquet' and not parquet_available():
+            return jsonify({"error": "Parquet output needs pyarrow, which isn't installed"}), 400
+
+        bypass_cache = request_flag('no_cache')
+        with stage('cache'):
+            cache_key = ResultCache.make_key(file.stream, f'{ANALYZER_VERSION}:weights:{by}:{output_format}:{pages}')
+            entry = None if bypass_cache else result_cache.get(cache_key)
+        if entry is None:
+            skipped = {}
+            # the criteria are collected while the pages are extracted, the PDF is read once
+            criteria_by_page = {}
+            all_pages_data = process_pages(file.stream, workers=requested_workers(), pages=pages,
+                                           skipped=skipped, weight_criteria=criteria_by_page)
+            with stage('weights'):
+                payload = serialize(weights_table(all_pages_data, criteria_by_page, by), output_format)
+            result_cache.set(cache_key, cache_entry(payload, skipped))
+            skipped = skipped_header(skipped)
+        else:
+            skipped, payload = split_cache_entry(entry)
+
+        response = json_payload_response(payload, 'BYPASS' if bypass_cache else 'HIT' if entry else 'MISS')
+        response.mimetype = MIMETYPES[output_format]
+        response.headers['X-Skipped-Pages'] = skipped
+        return response
+
+    except PageSelectionError as e:
+        return jsonify({"error": str(e)}), 400
+    except MemoryLimitExceeded as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/region_tribs/reanalyze', methods=['POST'])
+def reanalyze():
+    """
+    Re-run the analysis of one page after a few annotations were edited.
+    The JSON body holds the "token" from a process_pdf call made with incremental=1, the 1-based
+    "page" and lists of "added", "removed" and "modified" annotations ({"subject", "coords"},
+    modified entries also "new_subject" and/or "new_coords"). Coordinates are in feet, or in PDF
+    points with "coordinate_space": "pdf".
+    """
+    body = request.get_json(silent=True)
+    if not body or 'token' not in body:
+        return jsonify({"error": "Missing token"}), 400
+
+    options = output_options()
+    if options['profile'] not in PROFILES:
+        return jsonify({"error": f"Unknown profile, expected one of {', '.join(PROFILES)}"}), 400
+
+    pages = load_session(body['token'])
+    if pages is None:
+        return jsonify({"error": "Unknown or expired token, process the PDF again"}), 404
+
+    page_number = body.get('page', 1)
+    if not isinstance(page_number, int) or not 1 <= page_number <= len(pages):
+        return jsonify({"error": "Invalid page"}), 400
+    page = pages[page_number - 1]
+    if page is None:
+        return jsonify({"error": "Page has no SCALE annotation"}), 400
+
+    try:
+        from tools.incremental_analysis import DeltaError, reanalyze_page
+        from tools.result_formats import format_page
+
+        try:
+            with stage('analyze'):
+                page_data, area_analysis = reanalyze_page(
+                    page['page_data'], page['area_analysis'], body)
+        except DeltaError as e:
+            return jsonify({"error": str(e)}), 400
+
+        pages[page_number - 1] = {'page_data': page_data, 'area_analysis': area_analysis}
+        with stage('serialize'):
+            token = store_session(pages)
+            payload = dumps({
+                "token": token,
+                "page": page_number,
+                "area_analysis": format_page(area_analysis, **options)
+            })
+        return json_payload_response(payload, 'BYPASS')
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/region_tribs/process_batch', methods=['POST'])
+def process_batch():
+    """
+    Process several PDFs in one request. Each "file" part is a PDF or a zip archive of PDFs.
+    The response maps every filename (archive/entry for zipped PDFs) to {"pages": [...],
+    "skipped": {...}}, the list and skipped pages process_pdf returns, or to {"error": "..."}
+    when that document failed.
+    """
+    with stage('upload'):
+        files = [file for file in request.files.getlist('file') if file.filename]
+    if not files:
+        return jsonify({"error": "No file part"}), 400
+
+    options = output_options()
+    if options['profile'] not in PROFILES:
+        return jsonify({"error": f"Unknown profile, expected one of {', '.join(PROFILES)}"}), 400
+
+    # optional "concurrency" form field, capped by REGION_TRIBS_BATCH_CONCURRENCY
+    concurrency = request.form.get('concurrency', type=int)
+    if concurrency is None or concurrency < 1:
+        concurrency = BATCH_CONCURRENCY
+    elif BATCH_CONCURRENCY:
+        concurrency = min(concurrency, BATCH_CONCURRENCY)
+
+    try:
+        with stage('upload'):
+            documents = read_batch_documents(files)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 413
+
+    try:
+        from tools.region_tribs_tools import process_documents
+        from tools.result_formats import format_pages
+
+        bypass_cache = request_flag('no_cache')
+        # name -> serialized {"pages": ...} or {"error": ...} entry
+        entries = {}
+        pending = []
+        with stage('cache'):
+            for name, data, error in documents:
+                if error is not None:
+                    entries[name] = dumps({"error": error})
+                    continue
+                cache_key = result_cache_key(data, options)
+                entry = None if bypass_cache else result_cache.get(cache_key)
+                if entry is None:
+                    pending.append((name, data, cache_key))
+                else:
+                    count('document_cache_hits')
+                    entries[name] = batch_entry(*split_cache_entry(entry))
+        count('documents', len(documents))
+
+        results = process_documents([data for _, data, _ in pending], concurrency) if pending else []
+        for (name, _, cache_key), (pages, skipped, error) in zip(pending, results):
+            if error is not None:
+                entries[name] = dumps({"error": error})
+                continue
+            with stage('serialize'):
+                payload = dumps(format_pages(pages, **options))
+            result_cache.set(cache_key, cache_entry(payload, skipped))
+            entries[name] = batch_entry(skipped_header(skipped), payload)
+
+        # cached results are reused as-is, so the response is assembled from the serialized parts
+        with stage('serialize'):
+            payload = b'{' + b','.join(dumps(name) + b':' + entries[name]
+                                       for name, _, _ in documents) + b'}'
+        # HIT only when every document came from the cache
+        return json_payload_response(payload, 'BYPASS' if bypass_cache else 'MISS' if pending else 'HIT')
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/region_tribs/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue a PDF for analysis in the background. Takes the same "file" and "pages" as process_pdf
+    and answers 202 with the job id; poll the status and result URLs for progress.
+    """
+    with stage('upload'):
+        files = request.files
+    if 'file' not in files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = files['file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    if not file.filename.endswith('.pdf'):
+        return jsonify({"error": "Invalid file type"}), 400
+
+    try:
+        store = get_job_store()
+        with stage('store'):
+            if JOB_RETENTION_SECONDS:
+                store.purge(JOB_RETENTION_SECONDS)
+            job_id = store.create(file.read(), {'pages': request.values.get('pages') or None})
+        if app.config['JOB_RUNNER'] == 'thread':
+            from tools.job_worker import start_job_thread
+
+            start_job_thread(store, job_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    status_url = f'/api/region_tribs/jobs/{job_id}'
+    response = jsonify({
+        "id": job_id,
+        "status": store.get(job_id)['status'],
+        "status_url": status_url,
+        "result_url": status_url + '/result'
+    })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+
+@app.route('/api/region_tribs/jobs/<job_id>')
+def job_status(job_id):
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    resume_abandoned_job(store, job)
+    return jsonify({key: job[key] for key in (
+        'id', 'status', 'page_count', 'pages_total', 'pages_done', 'skipped', 'error', 'created', 'updated')})
+
+
+@app.route('/api/region_tribs/jobs/<job_id>/result')
+def job_result(job_id):
+    """
+    The pages finished so far, in process_pdf's format and with its output options. Pages that
+    are still pending are null until "status" is "done".
+    """
+    options = output_options()
+    if options['profile'] not in PROFILES:
+        return jsonify({"error": f"Unknown profile, expected one of {', '.join(PROFILES)}"}), 400
+
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    resume_abandoned_job(store, job)
+
+    try:
+        from tools.result_formats import format_pages
+
+        with stage('store'):
+            finished = store.pages(job_id)
+        pages = [finished.get(page_number) for page_number in range(job['page_count'] or 0)]
+        with stage('serialize'):
+            payload = dumps({
+                "status": job['status'],
+                "pages_done": len(finished),
+                "pages_total": job['pages_total'],
+                "error": job['error'],
+                "pages": format_pages(pages, **options)
+            })
+        response = json_payload_response(payload, 'BYPASS')
+        response.headers['X-Skipped-Pages'] = skipped_header(job['skipped'])
+        return response
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
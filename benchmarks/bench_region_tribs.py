@@ -0,0 +1,137 @@
+"""
+pytest-benchmark suite for the region_tribs pipeline on synthetic drawing sets.
+
+Not collected by the default test run; run it explicitly:
+    pytest benchmarks/bench_region_tribs.py --benchmark-columns=min,mean,max,ops
+
+Each benchmark records its throughput (annotations or pages per second) and the peak
+Python heap allocated by one run (tracemalloc) in the benchmark's extra_info, which
+is shown with --benchmark-json or --benchmark-verbose.
+"""
+import io
+import tracemalloc
+import pytest
+from benchmarks.synthetic_pdf import generate_pdf
+from tools import result_json
+from tools.region_tribs_tools import AnnotationsExtractor, AreaElementAnalyzer
+
+pytest.importorskip('pytest_benchmark')
+
+# name: (pages, areas, walls, floors, roofs)
+SIZES = {
+    'small': (1, 16, 40, 8, 2),
+    'medium': (1, 100, 1000, 20, 4),
+    'large': (1, 400, 4000, 60, 8),
+}
+ENDPOINT_SIZES = {
+    'small': (3, 16, 40, 8, 2),
+    'medium': (10, 100, 1000, 20, 4),
+}
+
+
+@pytest.fixture(scope='module')
+def pdfs():
+    cache = {}
+
+    def get(pages, areas, walls, floors, roofs):
+        key = (pages, areas, walls, floors, roofs)
+        if key not in cache:
+            cache[key] = generate_pdf(pages=pages, areas=areas, walls=walls, floors=floors, roofs=roofs)
+        return cache[key]
+    return get
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def record(benchmark, items, unit, peak_bytes):
+    benchmark.extra_info[unit] = items
+    # there are no timings with --benchmark-disable, the benchmark then runs once as a plain test
+    if benchmark.stats:
+        benchmark.extra_info[f'{unit}_per_second'] = items / benchmark.stats.stats.mean
+    benchmark.extra_info['peak_memory_mb'] = peak_bytes / (1024 * 1024)
+
+
+# Annotation records as the page pipeline uses them, and the dicts they convert to
+@pytest.mark.parametrize('method', ['extract_annotations', 'extract_real_world_coordinates'])
+@pytest.mark.parametrize('size', list(SIZES))
+def test_extract_real_world_coordinates(benchmark, pdfs, size, method):
+    pages, areas, walls, floors, roofs = SIZES[size]
+    extractor = AnnotationsExtractor(pdfs(pages, areas, walls, floors, roofs))
+    extract = getattr(extractor, method)
+
+    def run():
+        # the annotation index is cached per page; drop it so every round parses /Annots
+        extractor.annotation_indexes.clear()
+        return extract(0)
+
+    page_data = benchmark(run)
+    record(benchmark, len(page_data['annotations']), 'annotations', peak_memory(run))
+
+
+@pytest.mark.parametrize('size', list(SIZES))
+def test_calculate_intersection_lengths(benchmark, pdfs, size):
+    pages, areas, walls, floors, roofs = SIZES[size]
+    with AnnotationsExtractor(pdfs(pages, areas, walls, floors, roofs)) as extractor:
+        page_data = extractor.extract_annotations(0)
+
+    def run():
+        return AreaElementAnalyzer(page_data).calculate_intersection_lengths()
+
+    area_analysis = benchmark(run)
+    assert len(area_analysis) == areas
+    record(benchmark, len(page_data['annotations']), 'annotations', peak_memory(run))
+
+
+def flask_dumps(value):
+    from api.region_tribs import app
+    return app.json.dumps(value).encode()
+
+
+# the encoder the API used before (Flask's provider) against result_json with and without orjson
+ENCODERS = {
+    'flask': flask_dumps,
+    'stdlib': result_json.stdlib_dumps,
+    'orjson': result_json.dumps,
+}
+
+
+@pytest.mark.parametrize('encoder', list(ENCODERS))
+@pytest.mark.parametrize('size', list(SIZES))
+def test_serialize_area_analysis(benchmark, pdfs, size, encoder):
+    if encoder == 'orjson' and result_json.orjson is None:
+        pytest.skip('orjson is not installed')
+    pages, areas, walls, floors, roofs = SIZES[size]
+    with AnnotationsExtractor(pdfs(pages, areas, walls, floors, roofs)) as extractor:
+        page_data = extractor.extract_real_world_coordinates(0)
+    area_analysis = AreaElementAnalyzer(page_data).calculate_intersection_lengths()
+    dumps = ENCODERS[encoder]
+
+    payload = benchmark(dumps, area_analysis)
+    benchmark.extra_info['payload_bytes'] = len(payload)
+    record(benchmark, len(area_analysis), 'areas', peak_memory(lambda: dumps(area_analysis)))
+
+
+@pytest.mark.parametrize('size', list(ENDPOINT_SIZES))
+def test_process_pdf_endpoint(benchmark, pdfs, size):
+    from api.region_tribs import app
+
+    pages, areas, walls, floors, roofs = ENDPOINT_SIZES[size]
+    pdf_bytes = pdfs(pages, areas, walls, floors, roofs)
+    client = app.test_client()
+
+    def run():
+        response = client.post('/api/region_tribs/process_pdf?no_cache=1',
+                               data={'file': (io.BytesIO(pdf_bytes), 'synthetic.pdf'), 'workers': '1'},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+        return response
+
+    benchmark.pedantic(run, rounds=3, iterations=1)
+    record(benchmark, pages, 'pages', peak_memory(run))
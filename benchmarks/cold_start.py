@@ -0,0 +1,98 @@
+"""
+Cold-start benchmark for the region_tribs serverless function.
+
+Each route is measured in a fresh interpreter, the way a Vercel cold start runs it:
+the time to import api.region_tribs, the latency of the first request to the route,
+and whether the PDF/geometry stack ended up loaded.
+
+Usage:
+    python -m benchmarks.cold_start [--runs N] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PDF = os.path.join(REPO_ROOT, 'tests', 'assets', 'test_region_tribs.pdf')
+
+# route, method, whether the request uploads the sample PDF
+ROUTES = [
+    ('/api/region_tribs/time', 'GET', False),
+    ('/api/region_tribs/random_number', 'GET', False),
+    ('/api/region_tribs/upload-pdf', 'POST', True),
+    ('/api/region_tribs/metadata', 'POST', True),
+    ('/api/region_tribs/process_pdf', 'POST', True),
+]
+
+# the PDF/geometry stack, and the job store's database driver
+HEAVY_MODULES = ('pypdf', 'shapely', 'numpy', 'sqlite3')
+
+_CHILD = '''
+import json, sys, time
+route, method, upload, pdf_path = sys.argv[1], sys.argv[2], sys.argv[3] == '1', sys.argv[4]
+start = time.perf_counter()
+from api.region_tribs import app
+imported = time.perf_counter()
+heavy_after_import = [name for name in {heavy!r} if name in sys.modules]
+client = app.test_client()
+if upload:
+    with open(pdf_path, 'rb') as pdf_file:
+        response = client.open(route, method=method, data={{'file': (pdf_file, 'sample.pdf')}},
+                               content_type='multipart/form-data')
+else:
+    response = client.open(route, method=method)
+done = time.perf_counter()
+print(json.dumps({{
+    'status': response.status_code,
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (done - imported) * 1000,
+    'heavy_after_import': heavy_after_import,
+    'heavy_after_request': [name for name in {heavy!r} if name in sys.modules],
+}}))
+'''.format(heavy=HEAVY_MODULES)
+
+
+def measure_route(route, method, upload):
+    output = subprocess.run(
+        [sys.executable, '-c', _CHILD, route, method, '1' if upload else '0', SAMPLE_PDF],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(runs=3):
+    results = []
+    for route, method, upload in ROUTES:
+        samples = [measure_route(route, method, upload) for _ in range(runs)]
+        results.append({
+            'route': route,
+            'status': samples[-1]['status'],
+            'import_ms': statistics.median(sample['import_ms'] for sample in samples),
+            'first_request_ms': statistics.median(sample['first_request_ms'] for sample in samples),
+            'heavy_after_import': samples[-1]['heavy_after_import'],
+            'heavy_after_request': samples[-1]['heavy_after_request'],
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters per route (median is reported)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'route':<36}{'status':>7}{'import ms':>11}{'first req ms':>14}  loaded after request")
+    for result in results:
+        print(f"{result['route']:<36}{result['status']:>7}{result['import_ms']:>11.1f}"
+              f"{result['first_request_ms']:>14.1f}  {', '.join(result['heavy_after_request']) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
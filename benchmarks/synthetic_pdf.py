@@ -0,0 +1,167 @@
+"""
+Synthetic marked-up drawing sets for benchmarks and tests.
+
+Each generated page carries a SCALE line, an EFFECTIVE SEISMIC WEIGHT CRITERIA note and
+configurable numbers of A: (tributary area), W: (wall), F: (floor) and R: (roof) markups,
+laid out the way AnnotationsExtractor expects them. A share of the polygons is rotated.
+
+Usage:
+    python -m benchmarks.synthetic_pdf out.pdf --pages 40 --areas 100 --walls 1000
+"""
+import argparse
+import io
+import random
+from pypdf import PdfWriter
+from pypdf.generic import (ArrayObject, DictionaryObject, FloatObject, NameObject, NumberObject,
+                           TextStringObject)
+
+PAGE_WIDTH = 2592  # 36" x 24" sheet at 72 points per inch
+PAGE_HEIGHT = 1728
+MARGIN = 72
+
+WALL_TYPES = {'Wall Type 1': (50, 9.67), 'Wall Type 2': (10, 10), 'Wall Type 3': (10, 9.67)}
+FLOOR_TYPES = {'Floor Type 1': 10, 'Floor Type 2': 15}
+ROOF_TYPES = {'Roof Type 1': (12, 20)}
+
+
+def weight_criteria_text():
+    lines = ['Effective Seismic Weight Criteria', '', '=== Roofs', '']
+    for label, (weight, snow) in ROOF_TYPES.items():
+        lines += [f'R: {label}', f'Weight: {weight} psf', f'Snow: {snow} psf', '']
+    lines += ['=== Floors', '']
+    for label, weight in FLOOR_TYPES.items():
+        lines += [f'F: {label}', f'Weight: {weight} psf', '']
+    lines += ['=== Walls', '']
+    for label, (weight, height) in WALL_TYPES.items():
+        lines += [f'W: {label}', f'Weight: {weight} psf', f'Height: {height} ft', '']
+    return '\r'.join(lines).strip()
+
+
+def _numbers(values):
+    return ArrayObject([FloatObject(round(value, 4)) for value in values])
+
+
+def _annotation(subtype, subject, contents=None, rotation=0, **entries):
+    annot = DictionaryObject({
+        NameObject('/Type'): NameObject('/Annot'),
+        NameObject('/Subtype'): NameObject(subtype),
+        NameObject('/Subj'): TextStringObject(subject),
+    })
+    if contents is not None:
+        annot[NameObject('/Contents')] = TextStringObject(contents)
+    if rotation:
+        annot[NameObject('/Rotation')] = NumberObject(rotation)
+    for key, value in entries.items():
+        annot[NameObject('/' + key)] = value
+
+    # /Rect is the bounding box of the markup
+    coords = entries.get('L') or entries.get('Vertices') or entries.get('Rect')
+    xs, ys = coords[0::2], coords[1::2]
+    annot.setdefault(NameObject('/Rect'), _numbers([min(xs), min(ys), max(xs), max(ys)]))
+    return annot
+
+
+def _random_polygon(rng, x0, y0, width, height):
+    # a convex-ish quadrilateral inside the given box, jittered so edges never coincide
+    return [x0 + rng.uniform(0, 0.2) * width, y0 + rng.uniform(0, 0.2) * height,
+            x0 + rng.uniform(0.8, 1) * width, y0 + rng.uniform(0, 0.2) * height,
+            x0 + rng.uniform(0.8, 1) * width, y0 + rng.uniform(0.8, 1) * height,
+            x0 + rng.uniform(0, 0.2) * width, y0 + rng.uniform(0.8, 1) * height]
+
+
+def page_annotations(rng, areas=16, walls=40, floors=8, roofs=2, rotated_fraction=0.25):
+    """Build the annotation dictionaries of one marked-up page."""
+    usable_width = PAGE_WIDTH - 2 * MARGIN
+    usable_height = PAGE_HEIGHT - 2 * MARGIN
+
+    def rotation():
+        return rng.choice((15, 30, 345)) if rng.random() < rotated_fraction else 0
+
+    annotations = [
+        # 1" = 1'-0": a one inch (72 point) line labelled 1'-0"
+        _annotation('/Line', 'SCALE', '1\'-0"', L=_numbers([MARGIN, MARGIN / 2, MARGIN + 72, MARGIN / 2])),
+        _annotation('/FreeText', 'EFFECTIVE SEISMIC WEIGHT CRITERIA', weight_criteria_text(),
+                    Rect=_numbers([PAGE_WIDTH - 400, MARGIN, PAGE_WIDTH - MARGIN, MARGIN + 300])),
+    ]
+
+    # tributary areas tile the sheet in a grid
+    columns = max(1, int(round(areas ** 0.5)))
+    rows = max(1, -(-areas // columns))
+    cell_width, cell_height = usable_width / columns, usable_height / rows
+    for i in range(areas):
+        x0 = MARGIN + (i % columns) * cell_width
+        y0 = MARGIN + (i // columns) * cell_height
+        annotations.append(_annotation(
+            '/Polygon', f'A: Region {i + 1}', rotation=rotation(),
+            Vertices=_numbers(_random_polygon(rng, x0, y0, cell_width, cell_height))))
+
+    for _ in range(walls):
+        label = rng.choice(list(WALL_TYPES))
+        points = []
+        x, y = rng.uniform(MARGIN, PAGE_WIDTH - MARGIN), rng.uniform(MARGIN, PAGE_HEIGHT - MARGIN)
+        for _ in range(rng.randint(2, 4)):
+            points += [x, y]
+            x = min(max(x + rng.uniform(-300, 300), MARGIN), PAGE_WIDTH - MARGIN)
+            y = min(max(y + rng.uniform(-300, 300), MARGIN), PAGE_HEIGHT - MARGIN)
+        if len(points) == 4:
+            annotations.append(_annotation('/Line', f'W: {label}', L=_numbers(points)))
+        else:
+            annotations.append(_annotation('/PolyLine', f'W: {label}', Vertices=_numbers(points)))
+
+    for kind, count, labels in (('F', floors, list(FLOOR_TYPES)), ('R', roofs, list(ROOF_TYPES))):
+        for _ in range(count):
+            width = rng.uniform(0.1, 0.5) * usable_width
+            height = rng.uniform(0.1, 0.5) * usable_height
+            x0 = rng.uniform(MARGIN, PAGE_WIDTH - MARGIN - width)
+            y0 = rng.uniform(MARGIN, PAGE_HEIGHT - MARGIN - height)
+            annotations.append(_annotation(
+                '/Polygon', f'{kind}: {rng.choice(labels)}', rotation=rotation(),
+                Vertices=_numbers(_random_polygon(rng, x0, y0, width, height))))
+
+    # measurement markups that the analysis ignores
+    annotations.append(_annotation('/PolyLine', 'Polylength Measurement',
+                                   Vertices=_numbers([MARGIN, MARGIN, MARGIN + 100, MARGIN + 50])))
+    return annotations
+
+
+def generate_pdf(pages=1, areas=16, walls=40, floors=8, roofs=2, rotated_fraction=0.25,
+                 blank_pages=0, seed=0):
+    """
+    Return the bytes of a drawing set with the given number of marked-up pages,
+    followed by blank_pages pages without any markup (title sheets, details).
+    """
+    rng = random.Random(seed)
+    writer = PdfWriter()
+    for page_number in range(pages + blank_pages):
+        writer.add_blank_page(PAGE_WIDTH, PAGE_HEIGHT)
+        if page_number >= pages:
+            continue
+        for annot in page_annotations(rng, areas, walls, floors, roofs, rotated_fraction):
+            writer.add_annotation(page_number, annot)
+
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('output', help='path of the PDF to write')
+    parser.add_argument('--pages', type=int, default=1)
+    parser.add_argument('--areas', type=int, default=16)
+    parser.add_argument('--walls', type=int, default=40)
+    parser.add_argument('--floors', type=int, default=8)
+    parser.add_argument('--roofs', type=int, default=2)
+    parser.add_argument('--rotated-fraction', type=float, default=0.25)
+    parser.add_argument('--blank-pages', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    pdf_bytes = generate_pdf(args.pages, args.areas, args.walls, args.floors, args.roofs,
+                             args.rotated_fraction, args.blank_pages, args.seed)
+    with open(args.output, 'wb') as f:
+        f.write(pdf_bytes)
+
+
+if __name__ == '__main__':
+    main()
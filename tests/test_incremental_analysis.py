@@ -0,0 +1,88 @@
+import pytest
+import json
+from benchmarks.synthetic_pdf import generate_pdf
+from tools.region_tribs_tools import AnnotationsExtractor, AreaElementAnalyzer
+from tools.incremental_analysis import DeltaError, apply_annotation_delta, reanalyze_page
+
+
+def plain(value):
+    return json.loads(json.dumps(value))
+
+
+@pytest.fixture(scope='module')
+def page():
+    pdf_bytes = generate_pdf(pages=1, areas=9, walls=40, floors=4, roofs=2, seed=3)
+    with AnnotationsExtractor(pdf_bytes) as extractor:
+        page_data = plain(extractor.extract_real_world_coordinates(0))
+    area_analysis = plain(AreaElementAnalyzer(page_data).calculate_intersection_lengths())
+    return page_data, area_analysis
+
+
+def annotations_with_prefix(page_data, prefix):
+    return [annotation for annotation in page_data['annotations'] if annotation['prefix'] == prefix]
+
+
+def assert_matches_full_analysis(page_data, area_analysis, delta):
+    new_page_data, updated = reanalyze_page(page_data, area_analysis, delta)
+    expected = AreaElementAnalyzer(new_page_data).calculate_intersection_lengths()
+    assert plain(updated) == plain(expected)
+    return new_page_data, updated
+
+
+def test_modify_wall(page):
+    page_data, area_analysis = page
+    wall = annotations_with_prefix(page_data, 'W')[0]
+    new_coords = [[x + 3.5, y - 2.0] for x, y in wall['coords']]
+    assert_matches_full_analysis(page_data, area_analysis, {
+        'modified': [{'subject': wall['subject'], 'coords': wall['coords'], 'new_coords': new_coords}]})
+
+
+def test_relabel_floor_and_remove_roof(page):
+    page_data, area_analysis = page
+    floor = annotations_with_prefix(page_data, 'F')[0]
+    roof = annotations_with_prefix(page_data, 'R')[0]
+    assert_matches_full_analysis(page_data, area_analysis, {
+        'modified': [{'subject': floor['subject'], 'coords': floor['coords'],
+                      'new_subject': 'F: Floor Type 9'}],
+        'removed': [{'subject': roof['subject'], 'coords': roof['coords']}]})
+
+
+def test_remove_every_element_of_a_label(page):
+    page_data, area_analysis = page
+    label = annotations_with_prefix(page_data, 'W')[0]['subject']
+    removed = [{'subject': annotation['subject'], 'coords': annotation['coords']}
+               for annotation in page_data['annotations'] if annotation['subject'] == label]
+    _, updated = assert_matches_full_analysis(page_data, area_analysis, {'removed': removed})
+    assert all(label[3:] not in area['wall_lengths'] for area in updated.values())
+
+
+def test_add_and_move_areas(page):
+    page_data, area_analysis = page
+    area = annotations_with_prefix(page_data, 'A')[4]
+    new_coords = [[x + 10, y + 10] for x, y in area['coords']]
+    assert_matches_full_analysis(page_data, area_analysis, {
+        'modified': [{'subject': area['subject'], 'coords': area['coords'], 'new_coords': new_coords}],
+        'added': [{'subject': 'A: Region 99', 'coords': [[50, 50], [150, 50], [150, 120], [50, 120]]},
+                  {'subject': 'W: Wall Type 7', 'type': 'Line', 'coords': [[40, 60], [160, 110]]}]})
+
+
+def test_pdf_coordinate_space(page):
+    page_data, _ = page
+    scale_factor = page_data['page_metadata']['scale_factor']
+    wall = annotations_with_prefix(page_data, 'W')[0]
+    pdf_coords = [[x * 12 / scale_factor, y * 12 / scale_factor] for x, y in wall['coords']]
+    new_page_data, changes = apply_annotation_delta(page_data, {
+        'coordinate_space': 'pdf', 'removed': [{'subject': wall['subject'], 'coords': pdf_coords}]})
+    assert len(new_page_data['annotations']) == len(page_data['annotations']) - 1
+    assert changes[0][1] is None
+
+
+def test_unknown_annotation(page):
+    page_data, area_analysis = page
+    with pytest.raises(DeltaError):
+        reanalyze_page(page_data, area_analysis, {
+            'removed': [{'subject': 'W: Wall Type 1', 'coords': [[0, 0], [1, 1]]}]})
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,77 @@
+import pytest
+from tools.instrumentation import (LatencyHistogram, MemoryLimitExceeded, Metrics, check_memory, count,
+                                   current_rss_bytes, current_timer, stage, start_request_timer, use_timer)
+
+
+def test_stages_without_timer_are_noops():
+    use_timer(None)
+    with stage('extract'):
+        count('pages')
+    assert current_timer() is None
+
+
+def test_request_timer():
+    timer = start_request_timer()
+    with stage('extract'):
+        count('pages')
+    with stage('extract'):
+        count('pages', 2)
+    with stage('analyze'):
+        pass
+    assert list(timer.stages) == ['extract', 'analyze']
+    assert timer.counts == {'pages': 3}
+
+    header = timer.server_timing()
+    assert header.startswith('extract;dur=')
+    assert ', analyze;dur=' in header
+    assert header.split(', ')[-1].startswith('total;dur=')
+
+    record = timer.log_record(route='/x', status=200)
+    assert record['route'] == '/x'
+    assert set(record['stages_ms']) == {'extract', 'analyze'}
+    use_timer(None)
+
+
+def test_peak_rss():
+    timer = start_request_timer()
+    start = timer.peak_rss
+    assert start > 0
+    with stage('allocate'):
+        block = bytearray(64 * 1024 * 1024)
+        block[::4096] = b'x' * len(block[::4096])
+    del block
+    assert timer.peak_rss >= start + 32 * 1024 * 1024
+    assert timer.log_record()['peak_rss_bytes'] == timer.peak_rss
+    use_timer(None)
+
+
+def test_check_memory():
+    check_memory(None)
+    check_memory(current_rss_bytes() * 4)
+    with pytest.raises(MemoryLimitExceeded):
+        check_memory(1)
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram()
+    for milliseconds in (1, 5, 7, 40000):
+        histogram.observe(milliseconds)
+    data = histogram.to_dict()
+    assert data['count'] == 4
+    assert data['buckets']['le_5'] == 2
+    assert data['buckets']['le_10'] == 1
+    assert data['buckets']['inf'] == 1
+
+
+def test_metrics_per_stage():
+    metrics = Metrics()
+    timer = start_request_timer()
+    with stage('extract'):
+        pass
+    metrics.observe_request('/route', timer)
+    assert set(metrics.to_dict()) == {'/route', '/route:extract'}
+    use_timer(None)
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,149 @@
+import os
+import time
+import pytest
+from tools import job_store
+from tools.job_store import (DONE, FAILED, QUEUED, RUNNING, FileJobStore, JobStore, SQLiteJobStore,
+                             make_job_store)
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'file':
+        return FileJobStore(str(tmp_path / 'jobs'))
+    return SQLiteJobStore(str(tmp_path / 'jobs.db'))
+
+
+def test_job_lifecycle(store):
+    job_id = store.create(b'%PDF-1.7', {'pages': '1-2'})
+    job = store.get(job_id)
+    assert job['status'] == QUEUED
+    assert job['options'] == {'pages': '1-2'}
+    assert store.load_pdf(job_id) == b'%PDF-1.7'
+
+    store.start(job_id, page_count=3, pages_total=2, skipped={2: 'no_scale'})
+    store.record_page(job_id, 0, {'Region 1': {'wall_lengths': {'Wall Type 1': 1.5}}})
+    job = store.get(job_id)
+    assert (job['page_count'], job['pages_total'], job['pages_done']) == (3, 2, 1)
+    assert job['skipped'] == {2: 'no_scale'}
+    assert store.pages(job_id) == {0: {'Region 1': {'wall_lengths': {'Wall Type 1': 1.5}}}}
+
+    store.finish(job_id)
+    assert store.get(job_id)['status'] == DONE
+
+    store.delete(job_id)
+    assert store.get(job_id) is None
+
+
+def test_claim_once(store):
+    first = store.create(b'a')
+    second = store.create(b'b')
+    assert store.claim(second) == second
+    assert store.claim(second) is None
+    assert store.get(second)['status'] == RUNNING
+    # the oldest queued job
+    assert store.claim() == first
+    assert store.claim() is None
+
+
+class Clock:
+    # stands in for the time module in tools.job_store
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_store, 'time', clock)
+    return clock
+
+
+def test_abandoned_job_is_claimed_again(store, clock):
+    job_id = store.create(b'a')
+    assert store.claim() == job_id
+    store.record_page(job_id, 0, {})
+    clock.now += store.lease_seconds - 1
+    assert store.claim() is None
+    assert store.claim(job_id) is None
+
+    # no progress for longer than the lease
+    clock.now += 2
+    assert store.claim(job_id) == job_id
+    assert store.claim() is None
+    assert store.get(job_id)['status'] == RUNNING
+    assert store.pages(job_id) == {0: {}}
+
+    store.finish(job_id)
+    clock.now += store.lease_seconds + 1
+    assert store.claim() is None
+
+
+def test_claim_races_between_processes(tmp_path, clock):
+    # two processes on one directory, each with its own store and lock
+    first = FileJobStore(str(tmp_path / 'jobs'))
+    second = FileJobStore(str(tmp_path / 'jobs'))
+    job_id = first.create(b'a')
+
+    # both see the job queued before either claims it
+    snapshot = second.get(job_id)
+    assert first.claim(job_id) == job_id
+    second.get = lambda job_id: dict(snapshot)
+    assert second.claim(job_id) is None
+    assert second.claim() is None
+    del second.get
+
+    # the same when an abandoned job is claimed again
+    clock.now += first.lease_seconds + 1
+    snapshot = second.get(job_id)
+    assert first.claim() == job_id
+    second.get = lambda job_id: dict(snapshot)
+    assert second.claim(job_id) is None
+    del second.get
+    assert first.get(job_id)['claims'] == 2
+
+
+def test_purge(store, clock):
+    old = store.create(b'a')
+    store.record_page(old, 0, {})
+    clock.now += 3600
+    new = store.create(b'b')
+    assert store.purge(3600) == 0
+    clock.now += 1
+    assert store.purge(3600) == 1
+    assert store.get(old) is None
+    assert store.get(new) is not None
+
+
+def test_failed_job(store):
+    job_id = store.create(b'a')
+    store.finish(job_id, error='broken')
+    job = store.get(job_id)
+    assert (job['status'], job['error']) == (FAILED, 'broken')
+
+
+def test_unknown_job(store):
+    assert store.get('0123abcd') is None
+    assert store.get('../etc') is None
+
+
+def test_incomplete_store_cannot_be_created():
+    class PartialStore(JobStore):
+        def create(self, pdf, options=None):
+            return 'id'
+
+    with pytest.raises(TypeError):
+        PartialStore()
+
+
+def test_make_job_store(tmp_path):
+    assert isinstance(make_job_store(f'sqlite://{tmp_path}/jobs.db'), SQLiteJobStore)
+    assert isinstance(make_job_store(f'file://{tmp_path}/a'), FileJobStore)
+    assert isinstance(make_job_store(str(tmp_path / 'b')), FileJobStore)
+    assert os.path.isdir(tmp_path / 'b')
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,89 @@
+import json
+import os
+import time
+import pytest
+from benchmarks.synthetic_pdf import generate_pdf
+from tools.job_store import DONE, FAILED, FileJobStore, SQLiteJobStore
+from tools.job_worker import run_job, start_job_thread, work
+from tools.region_tribs_tools import process_pages
+
+PDF_PATH = os.path.join(os.path.dirname(__file__), 'assets', 'test_region_tribs.pdf')
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteJobStore(str(tmp_path / 'jobs.db'))
+
+
+def test_run_job_matches_process_pages(store):
+    with open(PDF_PATH, 'rb') as pdf_file:
+        job_id = store.create(pdf_file.read())
+    store.claim(job_id)
+    run_job(store, job_id)
+
+    job = store.get(job_id)
+    assert job['status'] == DONE
+    assert (job['page_count'], job['pages_total'], job['pages_done']) == (3, 3, 3)
+    assert job['skipped'] == {3: 'no_annotations'}
+    pages = store.pages(job_id)
+    assert json.loads(json.dumps([pages[page_number] for page_number in range(3)])) == \
+        json.loads(json.dumps(process_pages(PDF_PATH, workers=1)))
+
+
+def test_run_job_resumes(store):
+    job_id = store.create(generate_pdf(pages=3, areas=4, walls=8), {'pages': '2-3'})
+    store.claim(job_id)
+    # page 2 was finished before the worker was interrupted
+    store.record_page(job_id, 1, 'recorded earlier')
+    run_job(store, job_id)
+    pages = store.pages(job_id)
+    assert sorted(pages) == [1, 2]
+    assert pages[1] == 'recorded earlier'
+
+
+@pytest.mark.parametrize('store_class', [FileJobStore, SQLiteJobStore])
+def test_work_resumes_abandoned_job(tmp_path, store_class):
+    store = store_class(str(tmp_path / 'jobs'), lease_seconds=0.05)
+    job_id = store.create(generate_pdf(pages=3, areas=4, walls=8))
+    # a worker that claimed the job and died after the first page
+    store.claim()
+    store.start(job_id, page_count=3, pages_total=3, skipped={})
+    store.record_page(job_id, 0, 'recorded earlier')
+    time.sleep(0.1)
+
+    work(store, once=True, retention=0)
+    job = store.get(job_id)
+    assert (job['status'], job['pages_done']) == (DONE, 3)
+    assert store.pages(job_id)[0] == 'recorded earlier'
+
+
+def test_work_purges_old_jobs(store):
+    job_id = store.create(b'not a pdf')
+    store.finish(job_id, error='broken')
+    time.sleep(0.01)
+    work(store, once=True, retention=0.001)
+    assert store.get(job_id) is None
+
+
+def test_failed_job_records_error(store):
+    job_id = store.create(b'not a pdf')
+    store.claim(job_id)
+    run_job(store, job_id)
+    job = store.get(job_id)
+    assert job['status'] == FAILED and job['error']
+
+
+def test_start_job_thread_and_work(store):
+    first = store.create(generate_pdf(pages=1, areas=4, walls=8))
+    thread = start_job_thread(store, first)
+    thread.join()
+    assert store.get(first)['status'] == DONE
+    assert start_job_thread(store, first) is None
+
+    second = store.create(generate_pdf(pages=1, areas=4, walls=8, seed=1))
+    work(store, once=True)
+    assert store.get(second)['status'] == DONE
+
+
+if __name__ == '__main__':
+    pytest.main()
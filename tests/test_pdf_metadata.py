@@ -0,0 +1,40 @@
+import io
+import os
+import pytest
+from pypdf import PdfReader
+from benchmarks.synthetic_pdf import generate_pdf
+from tools.pdf_metadata import iter_page_objects, page_count, read_metadata
+
+PDF_PATH = os.path.join(os.path.dirname(__file__), 'assets', 'test_region_tribs.pdf')
+
+
+def test_read_metadata_matches_pdf_reader():
+    reader = PdfReader(PDF_PATH)
+    metadata = read_metadata(PDF_PATH)
+    assert metadata['number_of_pages'] == len(reader.pages)
+    assert metadata['creator'] == reader.metadata.creator
+    assert [page['annotations'] for page in metadata['pages']] == [
+        len(page['/Annots'].get_object()) if '/Annots' in page else 0 for page in reader.pages]
+
+
+def test_page_walk_order():
+    pdf = generate_pdf(pages=2, areas=5, walls=4, blank_pages=2)
+    reader = PdfReader(io.BytesIO(pdf))
+    assert page_count(reader) == 4
+    assert [page.indirect_reference for page in iter_page_objects(reader)] == [
+        page.indirect_reference for page in reader.pages]
+
+    pages = read_metadata(io.BytesIO(pdf))['pages']
+    assert [page['page'] for page in pages] == [1, 2, 3, 4]
+    assert [page['regions'] for page in pages] == [5, 5, 0, 0]
+    assert [page['scale'] for page in pages] == [True, True, False, False]
+
+
+def test_read_metadata_without_pages():
+    metadata = read_metadata(PDF_PATH, pages=False)
+    assert 'pages' not in metadata
+    assert metadata['number_of_pages'] == 3
+
+
+if __name__ == '__main__':
+    pytest.main()
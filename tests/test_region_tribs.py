@@ -1,8 +1,28 @@
 import pytest
+import gzip
+import io
 import os
-from api.region_tribs import app as flask_app
-from tools.region_tribs_tools import AnnotationsExtractor, AreaElementAnalyzer
+import json
+import tempfile
+import time
+import zipfile
+import numpy as np
+from shapely.geometry import LineString, MultiLineString, Polygon
+from shapely.affinity import rotate
+from api import region_tribs
+from api.region_tribs import app as flask_app, result_cache
+from tools.instrumentation import MemoryLimitExceeded, metrics
+from tools import region_tribs_tools
+from tools.job_store import SQLiteJobStore
+from tools.job_worker import run_job
+from tools.region_tribs_tools import (Annotation, AnnotationIndex, AnnotationsExtractor, AreaElementAnalyzer,
+                                     PageSelectionError, analyze_page, iter_analyzed_pages, process_documents,
+                                     process_pages, select_pages)
+from tools.result_formats import format_pages
 from flask_testing import TestCase
+from benchmarks.cold_start import measure_route
+from benchmarks.synthetic_pdf import WALL_TYPES, _annotation, _numbers, generate_pdf
+from pypdf import PdfReader, PdfWriter
 
 
 # ========= Routes
@@ -19,6 +39,17 @@ class TestApp(TestCase):
         assert "time" in response.json
 
 
+def test_light_routes_do_not_load_pdf_stack(tmp_path, monkeypatch):
+    # the job store is only created by the job routes
+    monkeypatch.setenv('REGION_TRIBS_JOB_STORE', str(tmp_path / 'jobs'))
+    # a fresh interpreter, as on a serverless cold start
+    result = measure_route('/api/region_tribs/time', 'GET', False)
+    assert result['status'] == 200
+    assert result['heavy_after_import'] == []
+    assert result['heavy_after_request'] == []
+    assert not (tmp_path / 'jobs').exists()
+
+
 class TestPDFUpload(TestCase):
     def create_app(self):
         flask_app.config['TESTING'] = True
@@ -46,6 +77,32 @@ class TestPDFUpload(TestCase):
         self.assertIn('author', json_response)
         self.assertIn('title', json_response)
 
+    def test_pdf_metadata(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            response = self.client.post('/api/region_tribs/metadata', data={'file': (pdf_file, 'sample.pdf')},
+                                        content_type='multipart/form-data')
+        assert response.status_code == 200
+        metadata = response.json
+        assert metadata['number_of_pages'] == 3
+        assert metadata['author'] == 'justin'
+        assert [(page['page'], page['scale'], page['weight_criteria'], page['regions'])
+                for page in metadata['pages']] == [(1, True, True, 2), (2, True, True, 2), (3, False, False, 0)]
+        assert metadata['pages'][2]['annotations'] == 0
+
+        with open(pdf_path, 'rb') as pdf_file:
+            response = self.client.post('/api/region_tribs/metadata?summary_only=1',
+                                        data={'file': (pdf_file, 'sample.pdf')},
+                                        content_type='multipart/form-data')
+        assert 'pages' not in response.json
+
+    def test_metadata_does_not_load_geometry_stack(self):
+        result = measure_route('/api/region_tribs/metadata', 'POST', True)
+        assert result['status'] == 200
+        assert 'shapely' not in result['heavy_after_request']
+        assert 'numpy' not in result['heavy_after_request']
+
 
 class TestPDFProcessing(TestCase):
     def create_app(self):
@@ -69,10 +126,616 @@ class TestPDFProcessing(TestCase):
             json_response = response.json
             print(json_response)
 
+    def test_process_pdf_timing(self):
+        metrics.clear()
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            data = {'file': (pdf_file, 'sample.pdf'), 'workers': '1'}
+            with self.assertLogs('region_tribs.requests', level='INFO') as logs:
+                response = self.client.post(
+                    '/api/region_tribs/process_pdf?no_cache=1', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+
+        stages = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        for name in ('upload', 'pdf_parse', 'annotations', 'extract', 'analyze', 'serialize', 'total'):
+            assert name in stages
+
+        record = json.loads(logs.records[-1].getMessage())
+        assert record['route'] == '/api/region_tribs/process_pdf'
+        assert record['status'] == 200
+        # the third page has no annotations and is screened out before extraction
+        assert record['counts']['pages'] == 2
+        assert record['counts']['skipped_pages'] == 1
+        assert record['counts']['annotations'] > 0
+
+        flask_app.config['METRICS_ENDPOINT'] = False
+        assert self.client.get('/api/region_tribs/metrics').status_code == 404
+        flask_app.config['METRICS_ENDPOINT'] = True
+        try:
+            histograms = self.client.get('/api/region_tribs/metrics').json
+        finally:
+            flask_app.config['METRICS_ENDPOINT'] = False
+        assert histograms['/api/region_tribs/process_pdf']['count'] == 1
+        assert '/api/region_tribs/process_pdf:analyze' in histograms
+
+    def test_reanalyze(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            data = {'file': (pdf_file, 'sample.pdf'), 'incremental': '1'}
+            response = self.client.post(
+                '/api/region_tribs/process_pdf', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        token = response.headers['X-Result-Token']
+        before = response.json[1]
+
+        wall = {'subject': 'W: Wall Type 2', 'coords': [[-100, -100], [200, 200]]}
+        response = self.client.post('/api/region_tribs/reanalyze', json={
+            'token': token, 'page': 2, 'added': [wall]})
+        assert response.status_code == 200
+        after = response.json['area_analysis']
+        assert response.json['token'] != token
+        assert set(after) == set(before)
+        assert any(area['wall_lengths']['Wall Type 2'] > before[label]['wall_lengths']['Wall Type 2']
+                   for label, area in after.items())
+
+        # the new token knows about the added wall
+        response = self.client.post('/api/region_tribs/reanalyze', json={
+            'token': response.json['token'], 'page': 2, 'removed': [wall]})
+        assert response.status_code == 200
+        assert response.json['area_analysis'] == before
+
+        response = self.client.post('/api/region_tribs/reanalyze', json={
+            'token': token, 'page': 2, 'removed': [{'subject': 'W: Nope', 'coords': [[0, 0], [1, 1]]}]})
+        assert response.status_code == 400
+        response = self.client.post('/api/region_tribs/reanalyze', json={'token': 'unknown', 'page': 1})
+        assert response.status_code == 404
+        response = self.client.post('/api/region_tribs/reanalyze', json={'token': token, 'page': 3})
+        assert response.status_code == 400
+
+    def test_incremental_pages_without_regions(self):
+        with_regions = PdfReader(io.BytesIO(generate_pdf(pages=1, areas=2, walls=4)))
+        no_regions = PdfReader(io.BytesIO(generate_pdf(pages=1, areas=0, walls=4, seed=1)))
+        writer = PdfWriter()
+        writer.add_page(with_regions.pages[0])
+        writer.add_page(no_regions.pages[0])
+        writer.add_blank_page(width=100, height=100)
+        pdf = io.BytesIO()
+        writer.write(pdf)
+        pdf.seek(0)
+
+        data = {'file': (pdf, 'sample.pdf'), 'incremental': '1'}
+        response = self.client.post(
+            '/api/region_tribs/process_pdf', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.json[1] == {}
+        # the page without regions was extracted, so it isn't reported as skipped
+        assert json.loads(response.headers['X-Skipped-Pages']) == {'3': 'no_annotations'}
+        response = self.client.post('/api/region_tribs/reanalyze', json={
+            'token': response.headers['X-Result-Token'], 'page': 2,
+            'added': [{'subject': 'A: Region 1', 'coords': [[0, 0], [50, 0], [50, 50], [0, 50]]}]})
+        assert response.status_code == 200
+        assert list(response.json['area_analysis']) == ['Region 1']
+
+    def test_incremental_session_too_large(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        original_limit = region_tribs.analysis_sessions.max_bytes
+        region_tribs.analysis_sessions.max_bytes = 1
+        try:
+            with open(pdf_path, 'rb') as pdf_file:
+                data = {'file': (pdf_file, 'sample.pdf'), 'incremental': '1'}
+                response = self.client.post(
+                    '/api/region_tribs/process_pdf', data=data, content_type='multipart/form-data')
+        finally:
+            region_tribs.analysis_sessions.max_bytes = original_limit
+        # the results are still returned, without a token that could never be redeemed
+        assert response.status_code == 200
+        assert len(response.json) == 3
+        assert 'X-Result-Token' not in response.headers
+
+    def test_process_pdf_ndjson_stream(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            data = {'file': (pdf_file, 'sample.pdf')}
+            expected = self.client.post(
+                '/api/region_tribs/process_pdf', data=data, content_type='multipart/form-data').json
+        with open(pdf_path, 'rb') as pdf_file:
+            data = {'file': (pdf_file, 'sample.pdf')}
+            response = self.client.post(
+                '/api/region_tribs/process_pdf', data=data, content_type='multipart/form-data',
+                headers={'Accept': 'application/x-ndjson'})
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        pages = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert len(pages) == 3
+        assert pages[2] is None
+        assert pages == expected
+
+    def test_process_pdf_profiles(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            data = {'file': (pdf_file, 'sample.pdf'), 'profile': 'summary', 'sparse': '1'}
+            response = self.client.post(
+                '/api/region_tribs/process_pdf', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        pages = response.json
+        assert pages[2] is None
+        assert set(pages[0]['Region 1']) == {'wall_lengths', 'floor_areas', 'roof_areas'}
+
+        with open(pdf_path, 'rb') as pdf_file:
+            data = {'file': (pdf_file, 'sample.pdf'), 'profile': 'columnar', 'precision': '2'}
+            response = self.client.post(
+                '/api/region_tribs/process_pdf', data=data, content_type='multipart/form-data',
+                headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        pages = json.loads(gzip.decompress(response.data))
+        assert pages[0]['areas'] == ['Region 1', 'Region 2']
+
+        with open(pdf_path, 'rb') as pdf_file:
+            data = {'file': (pdf_file, 'sample.pdf'), 'profile': 'nope'}
+            response = self.client.post(
+                '/api/region_tribs/process_pdf', data=data, content_type='multipart/form-data')
+        assert response.status_code == 400
+
+    def test_uploads_are_read_in_memory(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            data = {'file': (pdf_file, 'in_memory_upload.pdf')}
+            response = self.client.post(
+                '/api/region_tribs/process_pdf?no_cache=1', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert not os.path.exists('/tmp/in_memory_upload.pdf')
+
+    def test_process_pdf_with_workers(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+
+        responses = []
+        for workers in ('1', '2'):
+            with open(pdf_path, 'rb') as pdf_file:
+                data = {'file': (pdf_file, 'sample.pdf'), 'workers': workers}
+                response = self.client.post(
+                    '/api/region_tribs/process_pdf', data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+            responses.append(response.json)
+        assert responses[0] == responses[1]
+
+    def test_process_pdf_cache(self):
+        result_cache.clear()
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+
+        headers = []
+        responses = []
+        for url in ('/api/region_tribs/process_pdf',
+                    '/api/region_tribs/process_pdf',
+                    '/api/region_tribs/process_pdf?no_cache=1'):
+            with open(pdf_path, 'rb') as pdf_file:
+                data = {'file': (pdf_file, 'sample.pdf')}
+                response = self.client.post(
+                    url, data=data, content_type='multipart/form-data')
+            assert response.status_code == 200
+            headers.append(response.headers['X-Cache'])
+            responses.append(response.json)
+        assert headers == ['MISS', 'HIT', 'BYPASS']
+        assert responses[0] == responses[1] == responses[2]
+
+    def test_process_pdf_pages(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            full = self.client.post('/api/region_tribs/process_pdf?no_cache=1',
+                                    data={'file': (pdf_file, 'sample.pdf')},
+                                    content_type='multipart/form-data')
+        assert json.loads(full.headers['X-Skipped-Pages']) == {'3': 'no_annotations'}
+
+        for headers in ({}, {'Accept': 'application/x-ndjson'}):
+            with open(pdf_path, 'rb') as pdf_file:
+                response = self.client.post('/api/region_tribs/process_pdf?pages=2-', headers=headers,
+                                            data={'file': (pdf_file, 'sample.pdf')},
+                                            content_type='multipart/form-data')
+            assert response.status_code == 200
+            assert json.loads(response.headers['X-Skipped-Pages']) == {'3': 'no_annotations'}
+            pages = response.json if not headers else [
+                json.loads(line) for line in response.data.decode().splitlines()]
+            # unselected pages are null, the others match the full result
+            assert pages == [None, full.json[1], None]
+
+        # cached results keep their skipped pages
+        with open(pdf_path, 'rb') as pdf_file:
+            response = self.client.post('/api/region_tribs/process_pdf?pages=2-',
+                                        data={'file': (pdf_file, 'sample.pdf')},
+                                        content_type='multipart/form-data')
+        assert response.headers['X-Cache'] == 'HIT'
+        assert json.loads(response.headers['X-Skipped-Pages']) == {'3': 'no_annotations'}
+
+        for pages in ('4', '0-1', '2-1', 'x'):
+            with open(pdf_path, 'rb') as pdf_file:
+                response = self.client.post(f'/api/region_tribs/process_pdf?pages={pages}',
+                                            data={'file': (pdf_file, 'sample.pdf')},
+                                            content_type='multipart/form-data')
+            assert response.status_code == 400
+
+    def test_process_pdf_bounded_memory(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        responses = {}
+        for query, headers in (('no_cache=1', {}), ('bounded=1', {}), ('bounded=1&pages=2', {}),
+                               ('bounded=1&profile=columnar', {'Accept-Encoding': 'gzip'}),
+                               ('profile=columnar&no_cache=1', {})):
+            with open(pdf_path, 'rb') as pdf_file:
+                responses[query] = self.client.post(f'/api/region_tribs/process_pdf?{query}', headers=headers,
+                                                    data={'file': (pdf_file, 'sample.pdf')},
+                                                    content_type='multipart/form-data')
+            assert responses[query].status_code == 200
+            assert int(responses[query].headers['X-Peak-RSS']) > 0
+
+        assert responses['bounded=1'].json == responses['no_cache=1'].json
+        assert responses['bounded=1'].headers['X-Cache'] == 'BYPASS'
+        assert responses['bounded=1&pages=2'].json == [None, responses['no_cache=1'].json[1], None]
+        compressed = responses['bounded=1&profile=columnar']
+        assert compressed.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(compressed.data)) == responses['profile=columnar&no_cache=1'].json
+
+    def test_memory_and_upload_limits(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        original_limit = region_tribs_tools.MEMORY_LIMIT_BYTES
+        region_tribs_tools.MEMORY_LIMIT_BYTES = 1
+        try:
+            for query in ('bounded=1', 'no_cache=1&workers=1'):
+                with open(pdf_path, 'rb') as pdf_file:
+                    response = self.client.post(f'/api/region_tribs/process_pdf?{query}',
+                                                data={'file': (pdf_file, 'sample.pdf')},
+                                                content_type='multipart/form-data')
+                assert response.status_code == 503
+                assert 'limit' in response.json['error']
+        finally:
+            region_tribs_tools.MEMORY_LIMIT_BYTES = original_limit
+
+        flask_app.config['MAX_CONTENT_LENGTH'] = 1024
+        try:
+            with open(pdf_path, 'rb') as pdf_file:
+                response = self.client.post('/api/region_tribs/process_pdf',
+                                            data={'file': (pdf_file, 'sample.pdf')},
+                                            content_type='multipart/form-data')
+        finally:
+            flask_app.config['MAX_CONTENT_LENGTH'] = None
+        assert response.status_code == 413
+        assert 'error' in response.json
+
+    def test_seismic_weights(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        responses = {}
+        for query in ('no_cache=1', 'by=element&format=csv', 'format=xml', 'by=floor'):
+            with open(pdf_path, 'rb') as pdf_file:
+                responses[query] = self.client.post(f'/api/region_tribs/seismic_weights?{query}',
+                                                    data={'file': (pdf_file, 'sample.pdf')},
+                                                    content_type='multipart/form-data')
+
+        records = responses['no_cache=1'].json
+        assert [record['area'] for record in records] == ['Region 1', 'Region 2', 'Region 3', 'Region 4']
+        assert [record['page'] for record in records] == [1, 1, 2, 2]
+        for record in records:
+            assert record['total_weight'] == pytest.approx(
+                record['wall_weight'] + record['floor_weight'] + record['roof_weight'])
+        assert json.loads(responses['no_cache=1'].headers['X-Skipped-Pages']) == {'3': 'no_annotations'}
+
+        csv = responses['by=element&format=csv']
+        assert csv.mimetype == 'text/csv'
+        header, *rows = csv.data.decode().splitlines()
+        assert header == 'page,area,kind,label,quantity,unit_weight,height,snow,weight'
+        assert {row.split(',')[1] for row in rows} == {'Region 1', 'Region 2', 'Region 3', 'Region 4'}
+
+        assert responses['format=xml'].status_code == 400
+        assert responses['by=floor'].status_code == 400
+
+    def test_process_batch(self):
+        result_cache.clear()
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            sample = pdf_file.read()
+            pdf_file.seek(0)
+            single = self.client.post('/api/region_tribs/process_pdf?no_cache=1',
+                                      data={'file': (pdf_file, 'sample.pdf')},
+                                      content_type='multipart/form-data').json
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zipped:
+            zipped.writestr('set/sheet.pdf', generate_pdf(pages=1, areas=4, walls=8))
+            zipped.writestr('set/notes.txt', 'not a drawing')
+            zipped.writestr('__MACOSX/set/._sheet.pdf', b'resource fork')
+        archive.seek(0)
+
+        data = {'file': [(io.BytesIO(sample), 'sample.pdf'),
+                         (io.BytesIO(b'%PDF-1.7 truncated'), 'broken.pdf'),
+                         (archive, 'set.zip'),
+                         (io.BytesIO(b'text'), 'readme.txt'),
+                         (io.BytesIO(sample), 'sample.pdf')],
+                'concurrency': '2'}
+        response = self.client.post('/api/region_tribs/process_batch', data=data,
+                                    content_type='multipart/form-data')
+        assert response.status_code == 200
+        results = response.json
+        # upload order, zip entries as archive/entry and repeated names made unique
+        assert list(results) == ['sample.pdf', 'broken.pdf', 'set.zip/set/sheet.pdf', 'readme.txt',
+                                 'sample.pdf (2)']
+        assert results['sample.pdf'] == results['sample.pdf (2)'] == {
+            'pages': single, 'skipped': {'3': 'no_annotations'}}
+        assert 'error' in results['broken.pdf']
+        assert results['readme.txt'] == {'error': 'Invalid file type'}
+        assert len(results['set.zip/set/sheet.pdf']['pages']) == 1
+
+    def test_process_batch_with_corrupted_zip_member(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zipped:
+            zipped.writestr('ok.pdf', generate_pdf(pages=1, areas=4, walls=8))
+            zipped.writestr('bad.pdf', b'%PDF-1.7 ' + b'x' * 64)
+        # flip a byte of the stored member so its CRC no longer matches
+        data = archive.getvalue().replace(b'x' * 64, b'x' * 63 + b'y')
+
+        response = self.client.post('/api/region_tribs/process_batch',
+                                    data={'file': [(io.BytesIO(data), 'set.zip')]},
+                                    content_type='multipart/form-data')
+        assert response.status_code == 200
+        results = response.json
+        assert list(results) == ['set.zip/ok.pdf', 'set.zip/bad.pdf']
+        assert len(results['set.zip/ok.pdf']['pages']) == 1
+        assert 'CRC' in results['set.zip/bad.pdf']['error']
+
+    def test_process_batch_without_files(self):
+        response = self.client.post('/api/region_tribs/process_batch', data={},
+                                    content_type='multipart/form-data')
+        assert response.status_code == 400
+
+
+class TestJobs(TestCase):
+    def create_app(self):
+        flask_app.config['TESTING'] = True
+        return flask_app
+
+    def setUp(self):
+        self.previous_store = region_tribs.job_store
+        region_tribs.job_store = SQLiteJobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+        flask_app.config['JOB_RUNNER'] = 'external'
+
+    def tearDown(self):
+        region_tribs.job_store = self.previous_store
+        flask_app.config['JOB_RUNNER'] = 'thread'
+
+    def submit(self, url='/api/region_tribs/jobs'):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as pdf_file:
+            return self.client.post(url, data={'file': (pdf_file, 'sample.pdf')},
+                                    content_type='multipart/form-data')
+
+    def test_job_polling(self):
+        expected = self.submit('/api/region_tribs/process_pdf?no_cache=1').json
+
+        response = self.submit()
+        assert response.status_code == 202
+        job_id = response.json['id']
+        assert response.headers['Location'] == response.json['status_url'] == f'/api/region_tribs/jobs/{job_id}'
+        assert self.client.get(response.json['status_url']).json['status'] == 'queued'
+        assert self.client.get(response.json['result_url']).json['pages'] == []
+
+        # a worker that stops after the first page leaves a partial result
+        job_store = region_tribs.job_store
+        job_store.claim(job_id)
+        job_store.start(job_id, page_count=3, pages_total=3, skipped={})
+        job_store.record_page(job_id, 0, expected[0])
+        partial = self.client.get(response.json['result_url']).json
+        assert (partial['status'], partial['pages_done']) == ('running', 1)
+        assert partial['pages'] == [expected[0], None, None]
+
+        run_job(job_store, job_id)
+        status = self.client.get(response.json['status_url']).json
+        assert (status['status'], status['pages_done'], status['pages_total']) == ('done', 3, 3)
+        assert status['skipped'] == {'3': 'no_annotations'}
+        result = self.client.get(response.json['result_url'] + '?profile=summary')
+        assert result.json['pages'] == format_pages(expected, profile='summary')
+        assert json.loads(result.headers['X-Skipped-Pages']) == {'3': 'no_annotations'}
+
+    def test_job_thread_runner(self):
+        flask_app.config['JOB_RUNNER'] = 'thread'
+        job_id = self.submit().json['id']
+        for _ in range(100):
+            status = self.client.get(f'/api/region_tribs/jobs/{job_id}').json
+            if status['status'] == 'done':
+                break
+            time.sleep(0.1)
+        assert status['status'] == 'done'
+
+    def test_unknown_job(self):
+        assert self.client.get('/api/region_tribs/jobs/0123abcd').status_code == 404
+        assert self.client.get('/api/region_tribs/jobs/0123abcd/result').status_code == 404
+
 
 # ========= Tools
 
 
+def test_process_pages_parallel_matches_serial():
+    pdf_path = os.path.join(os.path.dirname(
+        __file__), 'assets', 'test_region_tribs.pdf')
+    serial = process_pages(pdf_path, workers=1)
+    parallel = process_pages(pdf_path, workers=2, min_pages_for_parallel=1)
+    assert len(parallel) == len(serial) == 3
+    # page order and per-page None entries are kept
+    assert [page is None for page in parallel] == [page is None for page in serial]
+    assert json.dumps(parallel) == json.dumps(serial)
+
+
+def test_requested_workers_are_capped(monkeypatch):
+    monkeypatch.setattr(region_tribs, 'PARALLEL_WORKERS', 4)
+    for workers, expected in (('500', 4), ('2', 2), ('0', None), ('x', None)):
+        with flask_app.test_request_context(method='POST', data={'workers': workers}):
+            assert region_tribs.requested_workers() == expected
+    monkeypatch.setattr(region_tribs, 'PARALLEL_WORKERS', 0)
+    with flask_app.test_request_context(method='POST', data={'workers': '500'}):
+        assert region_tribs.requested_workers() == (os.cpu_count() or 1)
+
+
+def test_select_pages():
+    assert select_pages(None, 3) == [0, 1, 2]
+    assert select_pages('3, 1-2', 5) == [0, 1, 2]
+    assert select_pages('4-', 5) == [3, 4]
+    assert select_pages('-2', 5) == [0, 1]
+    assert select_pages([2, 2, 1], 5) == [0, 1]
+    for pages in ('', '6', '0', '3-2', 'a-b', []):
+        with pytest.raises(PageSelectionError):
+            select_pages(pages, 5)
+
+
+def test_process_pages_screens_pages():
+    # a marked-up page followed by two blank ones
+    pdf_bytes = generate_pdf(pages=1, areas=4, walls=8, blank_pages=2)
+    unscreened = AnnotationsExtractor(pdf_bytes)
+    expected = [AreaElementAnalyzer(unscreened.extract_from_index(
+        unscreened.get_annotation_index(0), 0)).calculate_intersection_lengths()]
+
+    no_regions = generate_pdf(pages=1, areas=0, walls=8, seed=1)
+    extractor = AnnotationsExtractor(no_regions)
+    assert extractor.screen_page(0) == 'no_regions'
+    assert extractor.annotation_indexes == {}
+    assert AreaElementAnalyzer(extractor.extract_real_world_coordinates(0)).calculate_intersection_lengths() == {}
+
+    skipped = {}
+    pages = process_pages(pdf_bytes, workers=1, skipped=skipped)
+    assert skipped == {2: 'no_annotations', 3: 'no_annotations'}
+    assert json.dumps(pages) == json.dumps(expected + [None, None])
+
+    extractor = AnnotationsExtractor(pdf_bytes)
+    assert [extractor.screen_page(page_number) for page_number in range(3)] == [
+        None, 'no_annotations', 'no_annotations']
+    # screened out pages are never indexed
+    page_data = {}
+    list(iter_analyzed_pages(extractor, range(3), page_data=page_data))
+    assert [page_data[page_number] is None for page_number in range(3)] == [False, True, True]
+    assert extractor.annotation_indexes == {}
+
+    index = AnnotationsExtractor(no_regions).get_annotation_index(0)
+    assert index.skip_reason() == 'no_regions'
+
+
+def test_release_page_drops_pdf_objects():
+    pdf_path = os.path.join(os.path.dirname(
+        __file__), 'assets', 'test_region_tribs.pdf')
+    extractor = AnnotationsExtractor(pdf_path)
+    page_data = extractor.extract_real_world_coordinates(0)
+    assert extractor.pdf_reader.resolved_objects
+    extractor.release_page(0)
+    assert not extractor.pdf_reader.resolved_objects
+    assert extractor.annotation_indexes == {}
+    # the page can be read again
+    assert json.dumps(extractor.extract_real_world_coordinates(0)) == json.dumps(page_data)
+
+
+def test_get_weight_criteria():
+    pdf_path = os.path.join(os.path.dirname(
+        __file__), 'assets', 'test_region_tribs.pdf')
+    extractor = AnnotationsExtractor(pdf_path)
+    # read from the subjects alone, then from the page's index
+    criteria = extractor.get_weight_criteria(0)
+    page_data = extractor.extract_real_world_coordinates(0)
+    assert criteria == page_data['page_metadata']['weight_criteria'] == extractor.get_weight_criteria(0)
+    assert extractor.get_weight_criteria(2) is None
+
+
+def test_process_pages_collects_weight_criteria():
+    pdf_bytes = generate_pdf(pages=4, areas=4, walls=8, blank_pages=1)
+    expected = AnnotationsExtractor(pdf_bytes).get_weight_criteria(0)
+    assert expected['Walls']
+
+    for workers in (1, 2):
+        weight_criteria = {}
+        process_pages(pdf_bytes, workers=workers, min_pages_for_parallel=1, pages='2-5',
+                      weight_criteria=weight_criteria)
+        # pages that aren't analyzed have no entry
+        assert weight_criteria == {2: expected, 3: expected, 4: expected}
+
+    # extracted pages keep their criteria once released
+    extractor = AnnotationsExtractor(pdf_bytes)
+    extractor.extract_real_world_coordinates(0)
+    extractor.release_page(0)
+    assert extractor.get_weight_criteria(0) == expected
+
+
+def test_process_pages_memory_limit(monkeypatch):
+    pdf_bytes = generate_pdf(pages=6, areas=2, walls=4)
+    for workers in (1, 2):
+        with pytest.raises(MemoryLimitExceeded):
+            process_pages(pdf_bytes, workers=workers, min_pages_for_parallel=1, memory_limit=1)
+
+    # workers check the limit themselves, so a pool never outgrows it unseen
+    monkeypatch.setattr(region_tribs_tools, '_worker_extractor', AnnotationsExtractor(pdf_bytes))
+    monkeypatch.setattr(region_tribs_tools, '_worker_memory_limit', 1)
+    with pytest.raises(MemoryLimitExceeded):
+        region_tribs_tools._analyze_page_in_worker(0)
+
+
+def test_subjects_that_are_not_markups():
+    assert AnnotationIndex.parse_subject('A: Region 1') == ('A', 'Region 1')
+    for subject in ('Reviewed:JM', 'https://example.com/sheet', 'Note: see detail 3', 'None'):
+        assert AnnotationIndex.parse_subject(subject) == (None, None)
+
+    # notes with a colon ahead of the markups, so the screen reads them too
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(generate_pdf(pages=1, areas=2, walls=8))))
+    annotations = writer.pages[0]['/Annots']
+    for subject in ('Reviewed:JM', 'https://example.com/sheet'):
+        annotations.insert(0, writer._add_object(_annotation('/Text', subject, Rect=_numbers([0, 0, 10, 10]))))
+    output = io.BytesIO()
+    writer.write(output)
+
+    skipped = {}
+    pages = process_pages(output.getvalue(), workers=1, skipped=skipped)
+    assert skipped == {}
+    assert list(pages[0]) == ['Region 1', 'Region 2']
+
+
+def test_annotation_records():
+    # about half of the polygons are rotated, which drops their closing vertex
+    pdf_bytes = generate_pdf(pages=1, areas=9, walls=30, floors=4, roofs=2, rotated_fraction=0.5)
+    extractor = AnnotationsExtractor(pdf_bytes)
+    page_data = extractor.extract_annotations(0)
+    annotations = page_data['annotations']
+    assert all(isinstance(annotation, Annotation) for annotation in annotations)
+    # every record's coordinates are a view into one array of the page's points
+    assert len({id(annotation.coords.base) for annotation in annotations}) == 1
+    assert annotations[0].coords.shape[1] == 2
+    assert [annotation.prefix for annotation in annotations].count('A') == 9
+
+    as_dicts = extractor.extract_real_world_coordinates(0)
+    assert [annotation.to_dict() for annotation in annotations] == as_dicts['annotations']
+    assert as_dicts['page_metadata'] == page_data['page_metadata']
+    round_trip = Annotation.from_dict(as_dicts['annotations'][0])
+    assert round_trip.to_dict() == as_dicts['annotations'][0]
+    assert Annotation.from_dict({'subject': 'W: Wall', 'coords': [(0, 0), (1, 1)]}).label == 'Wall'
+
+    assert json.dumps(AreaElementAnalyzer(page_data).calculate_intersection_lengths()) == json.dumps(
+        AreaElementAnalyzer(as_dicts).calculate_intersection_lengths())
+
+
+def test_process_documents_reports_errors_per_document():
+    pdf_path = os.path.join(os.path.dirname(
+        __file__), 'assets', 'test_region_tribs.pdf')
+    results = process_documents([pdf_path, b'not a pdf', pdf_path], concurrency=2)
+    assert len(results) == 3
+    assert results[0] == results[2]
+    pages, skipped, error = results[0]
+    assert error is None and json.dumps(pages) == json.dumps(process_pages(pdf_path, workers=1))
+    assert skipped == {3: 'no_annotations'}
+    assert results[1][:2] == (None, None) and results[1][2]
+
+
 class TestAnnotationsExtractor:
     @pytest.fixture
     def extractor(self):
@@ -88,24 +751,179 @@ class TestAnnotationsExtractor:
 
     def test_extract_real_world_coordinates(self, extractor):
         # Test this method with a known page number and expected annotations
-        # print("Testing test_extract_real_world_coordinates")
-        # print(extractor.extract_real_world_coordinates(0))
-        pass
+        page_data = extractor.extract_real_world_coordinates(0)
+        assert page_data['page_metadata']['page_number'] == 1
+        assert page_data['page_metadata']['scale_factor'] == pytest.approx(1 / 6, rel=1e-6)
+        assert len(page_data['annotations']) == 21
+        # the third page has no SCALE annotation
+        assert extractor.extract_real_world_coordinates(2) is None
+
+    def test_extract_synthetic_pdf(self):
+        pdf_bytes = generate_pdf(pages=2, areas=9, walls=20, floors=3, roofs=1, blank_pages=1)
+        with AnnotationsExtractor(pdf_bytes) as extractor:
+            pages = [extractor.extract_real_world_coordinates(page_number) for page_number in range(3)]
+        assert pages[2] is None
+        subjects = [annotation['subject'] for annotation in pages[0]['annotations']]
+        assert sum(subject.startswith('A: ') for subject in subjects) == 9
+        assert sum(subject.startswith('W: ') for subject in subjects) == 20
+        assert set(pages[0]['page_metadata']['weight_criteria']['Walls']) == set(WALL_TYPES)
+
+    def test_in_memory_sources(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        with open(pdf_path, 'rb') as f:
+            pdf_bytes = f.read()
+
+        class NonSeekableStream(io.RawIOBase):
+            def __init__(self, data):
+                self.data = io.BytesIO(data)
+
+            def readable(self):
+                return True
+
+            def readinto(self, buffer):
+                return self.data.readinto(buffer)
+
+        with AnnotationsExtractor(pdf_path) as extractor:
+            expected = extractor.extract_real_world_coordinates(0)
+        for source in (pdf_bytes, memoryview(pdf_bytes), io.BytesIO(pdf_bytes),
+                       NonSeekableStream(pdf_bytes)):
+            with AnnotationsExtractor(source, spool_threshold=1024) as extractor:
+                assert extractor.pdf_path is None
+                assert extractor.extract_real_world_coordinates(0) == expected
+
+    def test_iter_analyzed_pages(self, extractor):
+        page_data = {}
+        pages = list(iter_analyzed_pages(extractor, [0, 2], page_data=page_data))
+        assert [page_number for page_number, _ in pages] == [0, 2]
+        assert pages[1][1] is None and page_data[2] is None
+        assert extractor.annotation_indexes == {}
+        assert page_data[0] == extractor.extract_real_world_coordinates(0)
+        assert pages[0][1] == analyze_page(extractor, 0)
+        assert list(iter_analyzed_pages(extractor, [0, 2])) == pages
+
+    def test_rotate_polygon_coords(self):
+        polygons = [[(0, 0), (4, 0), (4, 2), (0, 2)],
+                    [(10, 10), (13, 11), (12, 15)]]
+        rotations = [15, 345]
+        points = np.array([point for polygon in polygons for point in polygon], dtype=float)
+        offsets = np.array([0, 4, 7])
+        rotated = AnnotationsExtractor.rotate_polygon_coords(points, offsets, rotations)
+        for polygon, rotation, start, end in zip(polygons, rotations, offsets[:-1], offsets[1:]):
+            expected = rotate(Polygon(polygon), -rotation, origin='center').exterior.coords[:-1]
+            assert rotated[start:end].tolist() == [list(point) for point in expected]
+
+    def test_annotation_index(self, extractor):
+        index = extractor.get_annotation_index(0)
+        assert index.first("SCALE") is not None
+        assert index.first("EFFECTIVE SEISMIC WEIGHT CRITERIA") is not None
+        assert [r.label for r in index.by_prefix['A']] == ['Region 1', 'Region 2']
+        assert all(r.subtype in AnnotationIndex.SHAPE_SUBTYPES for r in index.shapes)
+        # the index is built once per page
+        assert extractor.get_annotation_index(0) is index
+
+        page_data = extractor.extract_real_world_coordinates(0)
+        assert len(page_data['annotations']) == len(index.shapes)
+        assert 'weight_criteria' in page_data['page_metadata']
 
 
 class TestAreaElementAnalyzer:
     def test_process_data(self):
         mock_data = {
             'annotations': [
-                # Add mock annotation data here
+                {'type': 'Polygon', 'subject': 'A: Region 1', 'contents': 'None',
+                 'coords': [(0, 0), (10, 0), (10, 10), (0, 10)]},
+                {'type': 'Line', 'subject': 'W: Wall Type 1', 'contents': 'None',
+                 'coords': [(-5, 5), (15, 5)]},
+                {'type': 'Polygon', 'subject': 'F: Floor Type 1', 'contents': 'None',
+                 'coords': [(0, 0), (5, 0), (5, 5), (0, 5)]},
+                {'type': 'PolyLine', 'subject': 'Polylength Measurement', 'contents': 'None',
+                 'coords': [(0, 0), (1, 1)]},
             ]
         }
         analyzer = AreaElementAnalyzer(mock_data)
         # Assertions to check if areas, floors, roofs, and walls are processed correctly
+        assert [label for label, _ in analyzer.areas] == ['Region 1']
+        assert [label for label, _ in analyzer.walls] == ['Wall Type 1']
+        assert [label for label, _ in analyzer.floors] == ['Floor Type 1']
+        assert analyzer.roofs == []
+        assert analyzer.areas[0][1].area == 100
+        assert analyzer.walls[0][1].length == 20
 
     def test_calculate_intersection_lengths(self):
         # Similar to test_process_data, but also checks intersection lengths
-        pass
+        pdf_bytes = generate_pdf(pages=1, areas=9, walls=30, floors=4, roofs=2)
+        with AnnotationsExtractor(pdf_bytes) as extractor:
+            page_data = extractor.extract_real_world_coordinates(0)
+        area_analysis = AreaElementAnalyzer(page_data).calculate_intersection_lengths()
+        assert len(area_analysis) == 9
+        for area in area_analysis.values():
+            for label, intersections in area['wall_intersections'].items():
+                assert area['wall_lengths'][label] == pytest.approx(
+                    sum(intersection['length'] for intersection in intersections))
+        assert json.dumps(area_analysis) == json.dumps(
+            AreaElementAnalyzer(page_data).calculate_intersection_lengths_brute_force())
+
+    @staticmethod
+    def grid_page_data(n=6):
+        # n x n grid of 10' square areas, overlapped by walls, floors and roofs
+        annotations = []
+        for i in range(n):
+            for j in range(n):
+                x, y = i * 10, j * 10
+                annotations.append({
+                    'type': 'Polygon', 'subject': f'A: Region {i}-{j}', 'contents': 'None',
+                    'coords': [(x, y), (x + 10, y), (x + 10, y + 10), (x, y + 10)]})
+            annotations.append({
+                'type': 'PolyLine', 'subject': f'W: Wall Type {i % 3}', 'contents': 'None',
+                'coords': [(i * 10 + 5, -5), (i * 10 + 7, n * 10 + 5)]})
+            annotations.append({
+                'type': 'Line', 'subject': f'W: Wall Type {i % 3}', 'contents': 'None',
+                'coords': [(-5, i * 10 + 3), (n * 10 + 5, i * 10 + 3)]})
+            annotations.append({
+                'type': 'Polygon', 'subject': f'F: Floor Type {i % 2}', 'contents': 'None',
+                'coords': [(i * 10 + 2, 2), (i * 10 + 18, 4), (i * 10 + 15, n * 5), (i * 10 + 3, n * 5)]})
+        annotations.append({
+            'type': 'Polygon', 'subject': 'R: Roof Type 1', 'contents': 'None',
+            'coords': [(-1, -1), (n * 7, -1), (n * 7, n * 7), (-1, n * 7)]})
+        # a roof far away from every area
+        annotations.append({
+            'type': 'Polygon', 'subject': 'R: Roof Type 2', 'contents': 'None',
+            'coords': [(1000, 1000), (1010, 1000), (1010, 1010), (1000, 1010)]})
+        return {'page_metadata': {'page_number': 1, 'scale_factor': 0.5}, 'annotations': annotations}
+
+    def test_to_xy_coords_many(self):
+        geoms = [LineString([(0, 0), (1, 1), (2, 0)]),
+                 Polygon([(0, 0), (2, 0), (2, 2)]),
+                 MultiLineString([[(0, 0), (1, 0)], [(2, 0), (3, 0), (3, 1)]])]
+        real_coords, pdf_coords = AreaElementAnalyzer.to_xy_coords_many(geoms, 0.5)
+        for geom, real, pdf in zip(geoms, real_coords, pdf_coords):
+            assert json.dumps(real) == json.dumps(AreaElementAnalyzer.to_xy_coords(geom))
+            assert json.dumps(pdf) == json.dumps(AreaElementAnalyzer.to_xy_coords(
+                AreaElementAnalyzer.scale_linestring(geom, 0.5)))
+
+    def test_spatial_index_matches_brute_force(self):
+        page_data = self.grid_page_data()
+        indexed = AreaElementAnalyzer(page_data).calculate_intersection_lengths()
+        brute_force = AreaElementAnalyzer(
+            page_data).calculate_intersection_lengths_brute_force()
+        assert json.dumps(indexed) == json.dumps(brute_force)
+        assert indexed['Region 0-0']['roof_areas']['Roof Type 2'] == 0.0
+        assert indexed['Region 0-0']['wall_lengths']['Wall Type 0'] > 0
+
+    def test_spatial_index_matches_brute_force_on_sample_pdf(self):
+        pdf_path = os.path.join(os.path.dirname(
+            __file__), 'assets', 'test_region_tribs.pdf')
+        extractor = AnnotationsExtractor(pdf_path)
+        for page_num in range(extractor.get_number_of_pages()):
+            page_data = extractor.extract_real_world_coordinates(page_num)
+            if not page_data:
+                continue
+            indexed = AreaElementAnalyzer(
+                page_data).calculate_intersection_lengths()
+            brute_force = AreaElementAnalyzer(page_data).calculate_intersection_lengths(
+                use_spatial_index=False)
+            assert json.dumps(indexed) == json.dumps(brute_force)
 
 
 # Run the tests if this file is executed
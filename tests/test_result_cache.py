@@ -0,0 +1,77 @@
+import os
+import pytest
+from tools.result_cache import ResultCache
+
+
+def test_make_key_depends_on_bytes_and_version():
+    key = ResultCache.make_key(b'%PDF-1.7 a', '1')
+    assert key == ResultCache.make_key(b'%PDF-1.7 a', '1')
+    assert key != ResultCache.make_key(b'%PDF-1.7 b', '1')
+    assert key != ResultCache.make_key(b'%PDF-1.7 a', '2')
+
+
+def test_lru_eviction_by_size():
+    cache = ResultCache(max_bytes=10)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    assert cache.get('a') == b'1234'  # 'a' is now the most recently used
+    cache.set('c', b'1234')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234'
+    assert cache.get('c') == b'1234'
+    assert cache.current_bytes == 8
+
+    # entries larger than the whole cache are not kept in memory
+    assert cache.set('e', b'1234') is True
+    assert cache.set('d', b'x' * 11) is False
+    assert cache.get('d') is None
+
+
+def test_disk_layer(tmp_path):
+    cache = ResultCache(max_bytes=100, disk_dir=str(tmp_path))
+    cache.set('a', b'[1, 2]')
+
+    # a fresh instance (e.g. after the in-memory entry was evicted) reads from disk
+    other = ResultCache(max_bytes=100, disk_dir=str(tmp_path))
+    assert other.get('a') == b'[1, 2]'
+    assert other.get('missing') is None
+
+
+def test_disk_layer_size_limit(tmp_path):
+    cache = ResultCache(max_bytes=100, disk_dir=str(tmp_path), disk_max_bytes=10)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    os.utime(tmp_path / 'a.json', (1, 1))
+    os.utime(tmp_path / 'b.json', (2, 2))
+    cache.set('c', b'1234')
+    # the oldest file is deleted once the directory is over the limit
+    assert sorted(os.listdir(tmp_path)) == ['b.json', 'c.json']
+
+    # reading an entry from disk makes it the most recently used
+    other = ResultCache(max_bytes=100, disk_dir=str(tmp_path), disk_max_bytes=10)
+    os.utime(tmp_path / 'c.json', (3, 3))
+    assert other.get('b') == b'1234'
+    other.set('d', b'1234')
+    assert sorted(os.listdir(tmp_path)) == ['b.json', 'd.json']
+
+    # entries larger than the limit are not written
+    assert other.set('e', b'x' * 11) is True  # but still kept in memory
+    assert not os.path.exists(tmp_path / 'e.json')
+    assert other.set('f', b'x' * 101) is False
+
+
+def test_disk_write_failure_is_logged(tmp_path, monkeypatch, caplog):
+    cache = ResultCache(max_bytes=100, disk_dir=str(tmp_path))
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr('tools.result_cache.tempfile.mkstemp', fail)
+    with caplog.at_level('WARNING', logger='region_tribs.cache'):
+        cache.set('a', b'1')
+    assert 'disk full' in caplog.text
+    # the entry is still served from memory
+    assert cache.get('a') == b'1'
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,69 @@
+import pytest
+import os
+import json
+from tools.region_tribs_tools import process_pages
+from tools.result_formats import format_page, format_pages
+
+
+@pytest.fixture(scope='module')
+def pages():
+    pdf_path = os.path.join(os.path.dirname(
+        __file__), 'assets', 'test_region_tribs.pdf')
+    return process_pages(pdf_path, workers=1)
+
+
+def test_full_profile_is_unchanged(pages):
+    assert format_pages(pages) == pages
+    assert json.dumps(format_pages(pages, precision=None, sparse=False)) == json.dumps(pages)
+
+
+def test_summary_profile(pages):
+    summary = format_pages(pages, profile='summary')
+    assert summary[2] is None
+    area = summary[0]['Region 1']
+    assert set(area) == {'wall_lengths', 'floor_areas', 'roof_areas'}
+    assert area['wall_lengths'] == pages[0]['Region 1']['wall_lengths']
+    assert area['roof_areas'] == {'Roof Type 1': 0.0}
+
+    sparse = format_pages(pages, profile='summary', sparse=True)
+    assert sparse[0]['Region 1']['roof_areas'] == {}
+
+
+def test_sparse_full_profile(pages):
+    sparse = format_page(pages[0], sparse=True)
+    assert 'Roof Type 1' not in sparse['Region 1']['roof_intersections']
+    assert sparse['Region 1']['wall_intersections'] == pages[0]['Region 1']['wall_intersections']
+
+
+def test_precision(pages):
+    rounded = format_page(pages[0], precision=2)
+    for point in rounded['Region 1']['wall_intersections']['Wall Type 1'][0]['realCoords']:
+        assert all(round(value, 2) == value for value in point)
+
+
+def test_columnar_profile(pages):
+    page = pages[1]
+    columnar = format_page(page, profile='columnar', precision=3)
+    assert columnar['areas'] == list(page)
+
+    # area shapes round-trip through the flat arrays
+    offsets = columnar['area_offsets']
+    for i, area in enumerate(page.values()):
+        flat = columnar['area_realCoords'][offsets[i] * 2:offsets[i + 1] * 2]
+        assert flat == [round(value, 3) for point in area['realCoords'] for value in point]
+
+    rows = columnar['intersections']
+    expected_rows = sum(len(intersections) for area in page.values()
+                        for key in ('wall_intersections', 'floor_intersections', 'roof_intersections')
+                        for intersections in area[key].values())
+    assert len(rows['area']) == len(rows['measure']) == len(rows['offsets']) - 1 == expected_rows
+    assert len(rows['realCoords']) == len(rows['PDFCoords']) == rows['offsets'][-1] * 2
+
+
+def test_unknown_profile(pages):
+    with pytest.raises(ValueError):
+        format_pages(pages, profile='nope')
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,53 @@
+import json
+import os
+from collections import defaultdict
+import numpy as np
+import pytest
+from tools import result_json
+from tools.region_tribs_tools import process_pages
+from tools.result_formats import format_pages
+
+
+@pytest.fixture(scope='module')
+def pages():
+    pdf_path = os.path.join(os.path.dirname(
+        __file__), 'assets', 'test_region_tribs.pdf')
+    return process_pages(pdf_path, workers=1)
+
+
+def test_analysis_round_trips(pages):
+    payload = result_json.dumps(pages)
+    assert isinstance(payload, bytes)
+    # tuples become lists, the rest is unchanged
+    assert result_json.loads(payload) == json.loads(json.dumps(pages))
+
+
+@pytest.mark.parametrize('profile', ['full', 'summary', 'columnar'])
+def test_orjson_matches_stdlib(pages, profile):
+    if result_json.orjson is None:
+        pytest.skip('orjson is not installed')
+    formatted = format_pages(pages, profile=profile)
+    assert result_json.dumps(formatted) == result_json.stdlib_dumps(formatted)
+
+
+def test_analyzer_types():
+    value = defaultdict(lambda: defaultdict(float))
+    value['b']['wall'] += 1.5
+    value['a']['coords'] = [(0.0, 1.0), (2.0, 3.0)]
+    value['a']['array'] = np.array([1.0, 2.0])
+    value['a']['count'] = np.int64(3)
+    expected = b'{"a":{"array":[1.0,2.0],"coords":[[0.0,1.0],[2.0,3.0]],"count":3},"b":{"wall":1.5}}'
+    assert result_json.stdlib_dumps(value) == expected
+    assert result_json.dumps(value) == expected
+
+
+def test_stdlib_fallback(monkeypatch, pages):
+    expected = result_json.stdlib_dumps(pages)
+    monkeypatch.setattr(result_json, 'orjson', None)
+    assert result_json.dumps(pages) == expected
+    assert result_json.loads(expected) == json.loads(expected)
+
+
+def test_unserializable():
+    with pytest.raises(TypeError):
+        result_json.stdlib_dumps({'a': object()})
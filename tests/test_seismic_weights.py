@@ -0,0 +1,69 @@
+import io
+import pandas as pd
+import pytest
+from tools.seismic_weights import element_weights, parquet_available, seismic_weights, serialize
+
+CRITERIA = {
+    'Walls': {'Wall Type 1': {'Weight': 50.0, 'Height': 10.0}},
+    'Floors': {'Floor Type 1': {'Weight': 15.0}},
+    'Roofs': {'Roof Type 1': {'Weight': 12.0, 'Snow': 20.0}, 'Roof Type 2': {'Weight': 10.0, 'Snow': 40.0}},
+}
+
+
+def area(walls=None, floors=None, roofs=None):
+    return {'wall_lengths': walls or {}, 'floor_areas': floors or {}, 'roof_areas': roofs or {}}
+
+
+PAGES = [
+    {'Region 1': area({'Wall Type 1': 2.0}, {'Floor Type 1': 100.0}, {'Roof Type 1': 10.0}),
+     'Region 2': area({'Wall Type 1': 0.0}, {'Floor Type 1': 0.0}, {'Roof Type 2': 50.0})},
+    None,
+    {'Region 3': area({'Wall Type 9': 4.0}), 'Region 4': area()},
+]
+
+
+def test_element_weights():
+    elements = element_weights(PAGES, {1: CRITERIA, 3: CRITERIA})
+    weights = {(row.area, row.label): row.weight for row in elements.itertuples()}
+    assert weights[('Region 1', 'Wall Type 1')] == 50.0 * 10.0 * 2.0
+    assert weights[('Region 1', 'Floor Type 1')] == 15.0 * 100.0
+    # snow below the threshold doesn't count
+    assert weights[('Region 1', 'Roof Type 1')] == 12.0 * 10.0
+    # 20% of a snow load over 30 psf does
+    assert weights[('Region 2', 'Roof Type 2')] == pytest.approx((10.0 + 0.2 * 40.0) * 50.0)
+    # no criteria for this label on the page
+    assert pd.isna(weights[('Region 3', 'Wall Type 9')])
+
+
+def test_area_weights():
+    totals = seismic_weights(PAGES, {1: CRITERIA, 3: CRITERIA})
+    assert list(totals['area']) == ['Region 1', 'Region 2', 'Region 3', 'Region 4']
+    assert list(totals['page']) == [1, 1, 3, 3]
+    region_1 = totals.iloc[0]
+    assert (region_1['wall_weight'], region_1['floor_weight'], region_1['roof_weight']) == (1000.0, 1500.0, 120.0)
+    assert region_1['total_weight'] == 2620.0
+    # unknown labels and areas without elements add up to zero
+    assert list(totals['total_weight'][2:]) == [0.0, 0.0]
+
+
+def test_empty_document():
+    assert seismic_weights([None, None], {}).empty
+    assert seismic_weights([{}], {1: None}, by='element').empty
+    with pytest.raises(ValueError):
+        seismic_weights(PAGES, {}, by='page')
+
+
+def test_serialize():
+    totals = seismic_weights(PAGES, {1: CRITERIA})
+    records = pd.read_json(io.BytesIO(serialize(totals, 'json')), orient='records')
+    assert list(records.columns) == list(totals.columns)
+    csv = pd.read_csv(io.BytesIO(serialize(totals, 'csv')))
+    assert csv['total_weight'].tolist() == totals['total_weight'].tolist()
+    with pytest.raises(ValueError):
+        serialize(totals, 'xlsx')
+    if parquet_available():
+        assert pd.read_parquet(io.BytesIO(serialize(totals, 'parquet'))).equals(totals)
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,183 @@
+"""
+Incremental re-analysis of a page after a few annotations were edited.
+
+Only the area/element pairs touched by the edit are recomputed:
+- an added, removed or modified A: area is recomputed against every element;
+- an added, removed or modified W:/F:/R: element is recomputed, for its label only, in the
+  areas that intersect its old or new geometry.
+Everything else is carried over from the previous area_analysis.
+"""
+import numpy as np
+from shapely import STRtree
+from shapely.geometry import LineString, Polygon
+from tools.region_tribs_tools import AnnotationIndex, AreaElementAnalyzer
+
+# prefix -> (kind, totals key, intersections key)
+ELEMENT_KEYS = {'W': ('wall', 'wall_lengths', 'wall_intersections'),
+                'F': ('floor', 'floor_areas', 'floor_intersections'),
+                'R': ('roof', 'roof_areas', 'roof_intersections')}
+
+# coordinates match when they agree to this many feet
+COORDINATE_TOLERANCE = 1e-6
+
+
+class DeltaError(ValueError):
+    """The delta doesn't apply to the stored page, e.g. a removed annotation doesn't exist."""
+
+
+def normalize_annotation(annotation, scale_factor, coordinate_space='real'):
+    """
+    Turn a delta entry ({"subject", "coords"[, "type"]}) into the extractor's annotation dict.
+    coordinate_space 'pdf' means the coordinates are PDF points rather than feet.
+    """
+    subject = annotation.get('subject')
+    coords = annotation.get('coords')
+    if not subject or not coords:
+        raise DeltaError('Annotations need a subject and coords')
+    points = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if coordinate_space == 'pdf':
+        points = points * scale_factor / 12
+    prefix, label = AnnotationIndex.parse_subject(subject)
+    return {
+        'type': annotation.get('type') or ('PolyLine' if prefix == 'W' else 'Polygon'),
+        'subject': subject,
+        'contents': annotation.get('contents', 'None'),
+        'coords': [tuple(point) for point in points.tolist()],
+        'prefix': prefix,
+        'label': label
+    }
+
+
+def _same_annotation(annotation, target):
+    if annotation['subject'] != target['subject'] or len(annotation['coords']) != len(target['coords']):
+        return False
+    return np.allclose(np.asarray(annotation['coords'], dtype=float),
+                       np.asarray(target['coords'], dtype=float), rtol=0, atol=COORDINATE_TOLERANCE)
+
+
+def _find(annotations, target):
+    for i, annotation in enumerate(annotations):
+        if _same_annotation(annotation, target):
+            return i
+    raise DeltaError(f"No annotation '{target['subject']}' with the given coords on this page")
+
+
+def apply_annotation_delta(page_data, delta):
+    """
+    Return the page data with the delta applied, and the (old, new) annotation pairs that changed.
+    delta holds "added", "removed" and "modified" lists; a modified entry is the old annotation
+    plus "new_subject" and/or "new_coords".
+    """
+    scale_factor = page_data['page_metadata']['scale_factor']
+    coordinate_space = delta.get('coordinate_space', 'real')
+    annotations = list(page_data['annotations'])
+    changes = []
+
+    for entry in delta.get('removed', []):
+        old = normalize_annotation(entry, scale_factor, coordinate_space)
+        changes.append((annotations.pop(_find(annotations, old)), None))
+
+    for entry in delta.get('modified', []):
+        old = normalize_annotation(entry, scale_factor, coordinate_space)
+        i = _find(annotations, old)
+        new = normalize_annotation({
+            'subject': entry.get('new_subject', entry['subject']),
+            'coords': entry.get('new_coords', entry['coords']),
+            'type': annotations[i]['type'],
+            'contents': annotations[i]['contents'],
+        }, scale_factor, coordinate_space)
+        changes.append((annotations[i], new))
+        annotations[i] = new
+
+    for entry in delta.get('added', []):
+        new = normalize_annotation(entry, scale_factor, coordinate_space)
+        annotations.append(new)
+        changes.append((None, new))
+
+    return dict(page_data, annotations=annotations), changes
+
+
+def _geometry(annotation):
+    if annotation['prefix'] == 'W':
+        return LineString(annotation['coords'])
+    return Polygon(annotation['coords'])
+
+
+def _sub_analysis(page_data, annotations):
+    # analyze a subset of the page's annotations with the regular analyzer
+    return AreaElementAnalyzer(dict(page_data, annotations=annotations)).calculate_intersection_lengths()
+
+
+def reanalyze_page(page_data, area_analysis, delta):
+    """
+    Apply the delta to the page and update area_analysis (as returned by
+    calculate_intersection_lengths for page_data) by recomputing only the affected pairs.
+    Returns the new page data and the new area_analysis.
+    """
+    new_page_data, changes = apply_annotation_delta(page_data, delta)
+    annotations = new_page_data['annotations']
+    areas = [annotation for annotation in annotations if annotation.get('prefix') == 'A']
+    new_area_labels = {annotation['label'] for annotation in areas}
+
+    changed_areas = set()
+    changed_elements = set()  # (prefix, label)
+    changed_geometries = []
+    for old, new in changes:
+        for annotation in (old, new):
+            if annotation is None:
+                continue
+            if annotation['prefix'] == 'A':
+                changed_areas.add(annotation['label'])
+            elif annotation['prefix'] in ELEMENT_KEYS:
+                changed_elements.add((annotation['prefix'], annotation['label']))
+                changed_geometries.append(_geometry(annotation))
+
+    # copy the per-label dicts that may be updated, leaving the previous analysis untouched
+    updated = {area_label: {key: dict(value) if isinstance(value, dict) else value
+                            for key, value in area.items()}
+               for area_label, area in area_analysis.items() if area_label in new_area_labels}
+
+    # element edits: only the areas that the old or new geometry touches
+    if changed_elements:
+        area_polygons = [_geometry(annotation) for annotation in areas]
+        touched = set()
+        if area_polygons and changed_geometries:
+            _, area_rows = STRtree(area_polygons).query(changed_geometries, predicate='intersects')
+            touched = {areas[row]['label'] for row in area_rows.tolist()}
+        touched -= changed_areas
+
+        elements = [annotation for annotation in annotations
+                    if (annotation.get('prefix'), annotation.get('label')) in changed_elements]
+        partial = _sub_analysis(new_page_data, [annotation for annotation in areas
+                                                if annotation['label'] in touched] + elements)
+        remaining = {(annotation['prefix'], annotation['label']) for annotation in elements}
+
+        for area_label, area in updated.items():
+            for prefix, label in changed_elements:
+                _, totals_key, intersections_key = ELEMENT_KEYS[prefix]
+                if (prefix, label) not in remaining:
+                    # the last element with this label was removed
+                    area[totals_key].pop(label, None)
+                    area[intersections_key].pop(label, None)
+                elif area_label in touched:
+                    area[totals_key][label] = partial[area_label][totals_key][label]
+                    area[intersections_key][label] = partial[area_label][intersections_key][label]
+                elif label not in area[totals_key]:
+                    # a new label that doesn't reach this area
+                    area[totals_key][label] = 0.0
+                    area[intersections_key][label] = []
+
+    # area edits: the whole entry against every element
+    if changed_areas & new_area_labels:
+        elements = [annotation for annotation in annotations
+                    if annotation.get('prefix') in ELEMENT_KEYS]
+        partial = _sub_analysis(new_page_data, [annotation for annotation in areas
+                                                if annotation['label'] in changed_areas] + elements)
+        for area_label in changed_areas & new_area_labels:
+            updated[area_label] = partial[area_label]
+
+    # keep the areas in page order, as a full analysis would
+    ordered = {}
+    for annotation in areas:
+        ordered.setdefault(annotation['label'], updated[annotation['label']])
+    return new_page_data, ordered
@@ -0,0 +1,178 @@
+"""
+Lightweight per-request stage timing.
+
+A RequestTimer is attached to the current context for the duration of a request. Code in
+the API and in the analysis tools wraps its work in `with stage('name'):` and reports sizes
+with `count('name', n)`; both are no-ops when no timer is active, e.g. in scripts, tests or
+worker processes. The timings end up in Server-Timing headers, a structured log record per
+request and, optionally, in-process latency histograms.
+
+The process's resident set size is sampled at the start and end of every stage, and between
+pages by check_memory, to record each request's peak RSS. Memory used by worker processes
+isn't included.
+"""
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+request_logger = logging.getLogger('region_tribs.requests')
+
+_current_timer = ContextVar('region_tribs_request_timer', default=None)
+
+
+class MemoryLimitExceeded(MemoryError):
+    """The process grew past the configured memory ceiling; raised between pages instead of being OOM killed."""
+
+
+def current_rss_bytes():
+    try:
+        # second field: resident pages
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # no procfs (e.g. macOS): fall back to the process's peak, in bytes there and KiB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RequestTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = OrderedDict()  # stage name -> total seconds
+        self.counts = OrderedDict()
+        self.peak_rss = current_rss_bytes()
+
+    def sample_memory(self, rss=None):
+        self.peak_rss = max(self.peak_rss, current_rss_bytes() if rss is None else rss)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        # e.g. "upload;dur=1.2, pdf_parse;dur=10.5, total;dur=31.0"
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages.items()]
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+    def log_record(self, **fields):
+        record = dict(fields)
+        record['duration_ms'] = round(self.elapsed() * 1000, 3)
+        record['stages_ms'] = {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+        record['counts'] = dict(self.counts)
+        self.sample_memory()
+        record['peak_rss_bytes'] = self.peak_rss
+        return record
+
+
+def start_request_timer():
+    timer = RequestTimer()
+    _current_timer.set(timer)
+    return timer
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+def use_timer(timer):
+    # attach an existing timer to the current context, e.g. inside a streamed response
+    _current_timer.set(timer)
+
+
+@contextmanager
+def stage(name):
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    timer.sample_memory()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+        timer.sample_memory()
+
+
+def count(name, n=1):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.count(name, n)
+
+
+def check_memory(limit):
+    # record the RSS on the current timer and fail once it is above limit bytes (0 or None: no limit)
+    rss = current_rss_bytes()
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.sample_memory(rss)
+    if limit and rss > limit:
+        raise MemoryLimitExceeded(f"Memory use of {rss} bytes is above the limit of {limit} bytes")
+
+
+def log_request(timer, **fields):
+    request_logger.info(json.dumps(timer.log_record(**fields)))
+
+
+class LatencyHistogram:
+    # upper bounds in milliseconds; the last bucket catches everything slower
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def observe(self, milliseconds):
+        self.counts[bisect_left(self.BUCKETS_MS, milliseconds)] += 1
+        self.total += 1
+        self.sum_ms += milliseconds
+
+    def to_dict(self):
+        buckets = OrderedDict((f'le_{bound}', n) for bound, n in zip(self.BUCKETS_MS, self.counts))
+        buckets['inf'] = self.counts[-1]
+        return {'count': self.total, 'sum_ms': round(self.sum_ms, 3), 'buckets': buckets}
+
+
+class Metrics:
+    """In-process latency histograms per route and per route stage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, name, milliseconds):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].observe(milliseconds)
+
+    def observe_request(self, route, timer):
+        self.observe(route, timer.elapsed() * 1000)
+        for name, seconds in timer.stages.items():
+            self.observe(f'{route}:{name}', seconds * 1000)
+
+    def to_dict(self):
+        with self.lock:
+            return {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())}
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+
+metrics = Metrics()
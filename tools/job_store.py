@@ -0,0 +1,356 @@
+"""
+Storage for background analysis jobs.
+
+A job holds the uploaded PDF, its options (e.g. the page selection), a status and the area
+analysis of every page finished so far, so clients can poll for partial results. JobStore
+defines the interface; FileJobStore and SQLiteJobStore keep jobs in a local directory or
+SQLite database for development, tests and single-instance deployments. Other backends
+(e.g. a bucket plus a key-value store) implement its abstract methods.
+
+A running job holds a lease that every recorded page renews. When its worker dies the lease
+runs out after lease_seconds and the job can be claimed again; it resumes from the pages already
+recorded. purge removes jobs, PDF included, that haven't been updated for a given time.
+"""
+from abc import ABC, abstractmethod
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# a running job that hasn't been updated for this long is considered abandoned
+LEASE_SECONDS = 15 * 60
+
+
+class JobStore(ABC):
+    """
+    Jobs are dicts with "id", "status", "options", "page_count" (pages in the document),
+    "pages_total" (selected pages), "pages_done", "skipped" ({1-based page number: reason}),
+    "error", "created" and "updated".
+    Page results are stored per 0-based page number as plain JSON-compatible values.
+    """
+    lease_seconds = LEASE_SECONDS
+
+    @staticmethod
+    def new_job(options):
+        now = time.time()
+        return {'id': uuid.uuid4().hex, 'status': QUEUED, 'options': options, 'page_count': None,
+                'pages_total': None, 'pages_done': 0, 'skipped': {}, 'error': None,
+                'created': now, 'updated': now}
+
+    @abstractmethod
+    def create(self, pdf, options=None):
+        """Queue a job for the PDF bytes and return its id."""
+
+    @abstractmethod
+    def get(self, job_id):
+        """Return the job, or None for an unknown id."""
+
+    @abstractmethod
+    def load_pdf(self, job_id):
+        """Return the uploaded PDF bytes."""
+
+    def claimable(self, job, now=None):
+        # queued, or running with an expired lease
+        now = time.time() if now is None else now
+        return job['status'] == QUEUED or (
+            job['status'] == RUNNING and job['updated'] < now - self.lease_seconds)
+
+    @abstractmethod
+    def claim(self, job_id=None):
+        """
+        Move a claimable job (the given one, or the oldest) to running and return its id.
+        Returns None when there is nothing to claim, so two workers never run the same job.
+        """
+
+    @abstractmethod
+    def start(self, job_id, page_count, pages_total, skipped):
+        """Record the page counts and skipped pages once the document has been screened."""
+
+    @abstractmethod
+    def record_page(self, job_id, page_number, area_analysis):
+        """Store the area analysis of a finished page."""
+
+    @abstractmethod
+    def finish(self, job_id, error=None):
+        """Mark the job done, or failed with the error message."""
+
+    @abstractmethod
+    def pages(self, job_id):
+        """Return {0-based page number: area analysis} for the pages finished so far."""
+
+    @abstractmethod
+    def delete(self, job_id):
+        """Remove the job, its PDF and its page results."""
+
+    @abstractmethod
+    def purge(self, max_age):
+        """Delete every job that hasn't been updated for max_age seconds and return how many."""
+
+
+class FileJobStore(JobStore):
+    """
+    One directory per job: job.json, document.pdf and a pages/<page number>.json per page.
+    Files are replaced atomically, so readers never see a partial write.
+    job.json also counts the job's "claims"; claim n creates the marker file claim-<n>.
+    """
+
+    def __init__(self, directory, lease_seconds=LEASE_SECONDS):
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, job_id, *parts):
+        # ids are generated hex strings; anything else can't name a job
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        return os.path.join(self.directory, job_id, *parts)
+
+    def _write(self, path, data):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _save(self, job):
+        job['updated'] = time.time()
+        self._write(self._path(job['id'], 'job.json'), json.dumps(job).encode())
+
+    def create(self, pdf, options=None):
+        job = self.new_job(options or {})
+        os.makedirs(self._path(job['id'], 'pages'))
+        self._write(self._path(job['id'], 'document.pdf'), bytes(pdf))
+        self._save(job)
+        return job['id']
+
+    def get(self, job_id):
+        path = self._path(job_id, 'job.json')
+        try:
+            with open(path, 'rb') as f:
+                job = json.loads(f.read())
+        except (OSError, TypeError):
+            return None
+        # JSON object keys are strings
+        job['skipped'] = {int(page): reason for page, reason in job['skipped'].items()}
+        return job
+
+    def load_pdf(self, job_id):
+        with open(self._path(job_id, 'document.pdf'), 'rb') as f:
+            return f.read()
+
+    def _jobs(self):
+        return [job for job in map(self.get, os.listdir(self.directory)) if job is not None]
+
+    def claim(self, job_id=None):
+        with self.lock:
+            now = time.time()
+            if job_id is None:
+                claimable = [job for job in self._jobs() if self.claimable(job, now)]
+                if not claimable:
+                    return None
+                job = min(claimable, key=lambda job: job['created'])
+            else:
+                job = self.get(job_id)
+                if job is None or not self.claimable(job, now):
+                    return None
+            # Compare-and-set across processes: the marker is numbered after the claims count of
+            # the snapshot checked above and creating it is atomic. Another process that checked
+            # the same snapshot, or an older one, fails to create the same marker.
+            attempt = job.get('claims', 0) + 1
+            try:
+                os.close(os.open(self._path(job['id'], f'claim-{attempt}'),
+                                 os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except OSError:
+                return None
+            job = self.get(job['id'])
+            job.update(status=RUNNING, claims=attempt)
+            self._save(job)
+            return job['id']
+
+    def start(self, job_id, page_count, pages_total, skipped):
+        with self.lock:
+            job = self.get(job_id)
+            job.update(page_count=page_count, pages_total=pages_total, skipped=skipped,
+                       pages_done=len(os.listdir(self._path(job_id, 'pages'))))
+            self._save(job)
+
+    def record_page(self, job_id, page_number, area_analysis):
+        self._write(self._path(job_id, 'pages', f'{page_number}.json'), json.dumps(area_analysis).encode())
+        with self.lock:
+            job = self.get(job_id)
+            job['pages_done'] = len(os.listdir(self._path(job_id, 'pages')))
+            self._save(job)
+
+    def finish(self, job_id, error=None):
+        with self.lock:
+            job = self.get(job_id)
+            job.update(status=FAILED if error else DONE, error=error)
+            self._save(job)
+
+    def pages(self, job_id):
+        pages = {}
+        directory = self._path(job_id, 'pages')
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    pages[int(name[:-len('.json')])] = json.loads(f.read())
+        return pages
+
+    def delete(self, job_id):
+        shutil.rmtree(self._path(job_id), ignore_errors=True)
+
+    def purge(self, max_age):
+        expired = [job['id'] for job in self._jobs() if job['updated'] < time.time() - max_age]
+        for job_id in expired:
+            self.delete(job_id)
+        return len(expired)
+
+
+class SQLiteJobStore(JobStore):
+    """Jobs and page results in two tables of a SQLite database file."""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, status TEXT NOT NULL, options TEXT NOT NULL,
+            page_count INTEGER, pages_total INTEGER, skipped TEXT NOT NULL, error TEXT,
+            created REAL NOT NULL, updated REAL NOT NULL, pdf BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS job_pages (
+            job_id TEXT NOT NULL, page_number INTEGER NOT NULL, area_analysis TEXT NOT NULL,
+            PRIMARY KEY (job_id, page_number));
+    '''
+    COLUMNS = ('id', 'status', 'options', 'page_count', 'pages_total', 'skipped', 'error',
+               'created', 'updated')
+
+    def __init__(self, path, lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.executescript(self.SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # a connection per call keeps the store usable from the request and worker threads
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA busy_timeout = 30000')
+        return _closing_transaction(connection)
+
+    def create(self, pdf, options=None):
+        job = self.new_job(options or {})
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job['id'], job['status'], json.dumps(job['options']), None, None, '{}', None,
+                 job['created'], job['updated'], bytes(pdf)))
+        return job['id']
+
+    def get(self, job_id):
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            pages_done, = connection.execute(
+                'SELECT COUNT(*) FROM job_pages WHERE job_id = ?', (job_id,)).fetchone()
+        job = dict(zip(self.COLUMNS, row))
+        job['options'] = json.loads(job['options'])
+        job['skipped'] = {int(page): reason for page, reason in json.loads(job['skipped']).items()}
+        job['pages_done'] = pages_done
+        return job
+
+    def load_pdf(self, job_id):
+        with self._connect() as connection:
+            pdf, = connection.execute('SELECT pdf FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return pdf
+
+    # queued, or running with an expired lease; see JobStore.claimable
+    CLAIMABLE = '(status = ? OR (status = ? AND updated < ?))'
+
+    def claim(self, job_id=None):
+        now = time.time()
+        claimable = (QUEUED, RUNNING, now - self.lease_seconds)
+        with self._connect() as connection:
+            if job_id is None:
+                row = connection.execute(
+                    f'SELECT id FROM jobs WHERE {self.CLAIMABLE} ORDER BY created LIMIT 1', claimable).fetchone()
+                if row is None:
+                    return None
+                job_id, = row
+            # the status check makes the update a compare-and-set
+            claimed = connection.execute(
+                f'UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND {self.CLAIMABLE}',
+                (RUNNING, now, job_id) + claimable).rowcount
+        return job_id if claimed else None
+
+    def start(self, job_id, page_count, pages_total, skipped):
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE jobs SET page_count = ?, pages_total = ?, skipped = ?, updated = ? WHERE id = ?',
+                (page_count, pages_total, json.dumps(skipped), time.time(), job_id))
+
+    def record_page(self, job_id, page_number, area_analysis):
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO job_pages VALUES (?, ?, ?)',
+                               (job_id, page_number, json.dumps(area_analysis)))
+            connection.execute('UPDATE jobs SET updated = ? WHERE id = ?', (time.time(), job_id))
+
+    def finish(self, job_id, error=None):
+        with self._connect() as connection:
+            connection.execute('UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?',
+                               (FAILED if error else DONE, error, time.time(), job_id))
+
+    def pages(self, job_id):
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT page_number, area_analysis FROM job_pages WHERE job_id = ?', (job_id,)).fetchall()
+        return {page_number: json.loads(area_analysis) for page_number, area_analysis in rows}
+
+    def delete(self, job_id):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM job_pages WHERE job_id = ?', (job_id,))
+            connection.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def purge(self, max_age):
+        cutoff = time.time() - max_age
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM job_pages WHERE job_id IN (SELECT id FROM jobs WHERE updated < ?)', (cutoff,))
+            return connection.execute('DELETE FROM jobs WHERE updated < ?', (cutoff,)).rowcount
+
+
+class _closing_transaction:
+    # "with" block that runs in one transaction and closes the connection afterwards
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.connection.close()
+
+
+def make_job_store(url, lease_seconds=LEASE_SECONDS):
+    """
+    Build a store from a URL: "sqlite:///path/to/jobs.db" or "file:///path/to/directory".
+    A plain path is a file store directory.
+    """
+    if url.startswith('sqlite://'):
+        return SQLiteJobStore(url[len('sqlite://'):], lease_seconds)
+    if url.startswith('file://'):
+        return FileJobStore(url[len('file://'):], lease_seconds)
+    return FileJobStore(url, lease_seconds)
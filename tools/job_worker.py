@@ -0,0 +1,81 @@
+"""
+Runs queued analysis jobs from a JobStore.
+
+run_job analyzes a claimed job page by page with the regular pipeline and records every page
+as soon as it is done, so status and partial results can be polled while it runs. A job that
+was interrupted (e.g. the instance was recycled) is claimed again once its lease has run out and
+resumes from the pages already recorded.
+
+Jobs are run either in a background thread of the API process (start_job_thread) or by a
+separate worker process polling the store:
+    python -m tools.job_worker sqlite:///tmp/region_tribs_jobs.db
+"""
+import argparse
+import threading
+import time
+from tools.job_store import make_job_store
+from tools.region_tribs_settings import JOB_LEASE_SECONDS, JOB_RETENTION_SECONDS
+from tools.region_tribs_tools import (AnnotationsExtractor, iter_analyzed_pages, select_pages,
+                                      to_plain_dict)
+
+
+def run_job(store, job_id):
+    """Analyze a job that has been claimed. Failures are recorded on the job rather than raised."""
+    job = store.get(job_id)
+    try:
+        finished = set(store.pages(job_id))
+        with AnnotationsExtractor(store.load_pdf(job_id)) as extractor:
+            page_numbers = select_pages(job['options'].get('pages'), extractor.get_number_of_pages())
+            skipped = extractor.screen_pages(page_numbers)
+            store.start(job_id, extractor.get_number_of_pages(), len(page_numbers), skipped)
+            pending = [page_number for page_number in page_numbers if page_number not in finished]
+            for page_number, area_analysis in iter_analyzed_pages(extractor, pending):
+                store.record_page(job_id, page_number, to_plain_dict(area_analysis))
+    except Exception as e:
+        store.finish(job_id, error=str(e))
+        return
+    store.finish(job_id)
+
+
+def start_job_thread(store, job_id):
+    # claim first, so an external worker polling the same store doesn't pick the job up too
+    if store.claim(job_id) is None:
+        return None
+    thread = threading.Thread(target=run_job, args=(store, job_id), name=f'job-{job_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def work(store, poll_interval=1.0, once=False, retention=JOB_RETENTION_SECONDS):
+    """
+    Claim and run queued and abandoned jobs, oldest first. With once, return when there is
+    nothing left to claim. Whenever the queue is empty, jobs older than retention seconds are
+    purged (0 keeps them).
+    """
+    while True:
+        job_id = store.claim()
+        if job_id is not None:
+            run_job(store, job_id)
+            continue
+        if retention:
+            store.purge(retention)
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('store', help='job store URL, e.g. sqlite:///tmp/jobs.db or file:///tmp/jobs')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds between queue checks')
+    parser.add_argument('--once', action='store_true', help='exit once no queued job is left')
+    parser.add_argument('--lease', type=float, default=JOB_LEASE_SECONDS,
+                        help='seconds after which a running job without progress is claimed again')
+    parser.add_argument('--retention', type=float, default=JOB_RETENTION_SECONDS,
+                        help='seconds after which jobs are deleted, 0 keeps them')
+    args = parser.parse_args()
+    work(make_job_store(args.store, args.lease), args.poll_interval, args.once, args.retention)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Document metadata and a per-page markup overview without running the analysis.
+
+PdfReader only reads the cross-reference table and trailer up front and resolves objects on
+access. The page count comes from the page tree root's /Count instead of flattening the tree,
+and the page walk below reads each page's /Annots and the annotation subjects only. Only pypdf
+is loaded, not the geometry stack.
+"""
+from pypdf import PdfReader
+
+INFO_FIELDS = ('author', 'creator', 'producer', 'subject', 'title')
+
+
+def document_info(reader):
+    # fields of the trailer's /Info dictionary, None when the PDF has none
+    metadata = reader.metadata
+    return {field: getattr(metadata, field) if metadata is not None else None for field in INFO_FIELDS}
+
+
+def page_count(reader):
+    try:
+        count = reader.trailer['/Root']['/Pages']['/Count']
+        if isinstance(count, int) and count >= 0:
+            return count
+    except (KeyError, TypeError, AttributeError):
+        pass
+    # a damaged page tree root, let pypdf walk the tree
+    return len(reader.pages)
+
+
+def iter_page_objects(reader):
+    """Yield the page dictionaries in document order, walking /Kids without copying inherited attributes."""
+    stack = [reader.trailer['/Root']['/Pages']]
+    seen = set()
+    while stack:
+        node_ref = stack.pop()
+        node = node_ref.get_object()
+        # a malformed tree can reference a node twice
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if node.get('/Type') == '/Pages' or '/Kids' in node:
+            stack.extend(reversed(node.get('/Kids', [])))
+        else:
+            yield node
+
+
+def page_markup(page):
+    """Count a page's annotations and report the markup the analysis looks for."""
+    annotations = page.get('/Annots')
+    annotations = annotations.get_object() if annotations is not None else []
+    summary = {'annotations': len(annotations), 'scale': False, 'weight_criteria': False, 'regions': 0}
+    for annot_ref in annotations:
+        subject = annot_ref.get_object().get('/Subj') or "None"
+        if subject == "SCALE":
+            summary['scale'] = True
+        elif subject == "EFFECTIVE SEISMIC WEIGHT CRITERIA":
+            summary['weight_criteria'] = True
+        elif subject.startswith('A: '):
+            summary['regions'] += 1
+    return summary
+
+
+def read_metadata(source, pages=True):
+    """
+    source is a path or a binary stream. Returns the /Info fields and "number_of_pages", plus
+    "pages" with page_markup for every page (1-based "page") unless pages is False.
+    """
+    reader = PdfReader(source)
+    metadata = document_info(reader)
+    metadata['number_of_pages'] = page_count(reader)
+    if pages:
+        metadata['pages'] = [dict(page=page_number, **page_markup(page))
+                             for page_number, page in enumerate(iter_page_objects(reader), 1)]
+    return metadata
@@ -0,0 +1,38 @@
+# Settings shared by the API and the analysis tools.
+# Kept free of pypdf, Shapely and NumPy imports so the API can read them without
+# loading the geometry stack on cold start.
+import os
+
+# Uploads larger than this are spooled to a temporary file instead of being held in memory
+SPOOL_THRESHOLD_BYTES = int(os.environ.get('REGION_TRIBS_SPOOL_THRESHOLD', 16 * 1024 * 1024))
+
+# Bump when the analysis output changes so cached results are not reused
+ANALYZER_VERSION = '2'
+
+# Below this many pages the PDF is processed in a single process.
+# The pool start-up cost outweighs the gain on small drawing sets.
+PARALLEL_MIN_PAGES = int(os.environ.get('REGION_TRIBS_PARALLEL_MIN_PAGES', 4))
+# Number of worker processes. 0 uses every available core, 1 disables the pool.
+PARALLEL_WORKERS = int(os.environ.get('REGION_TRIBS_WORKERS', 0))
+
+# Documents of a batch request analyzed at the same time, each in its own worker process.
+# 0 uses every available core.
+BATCH_CONCURRENCY = int(os.environ.get('REGION_TRIBS_BATCH_CONCURRENCY', 4))
+# Upper bound on the total size of the PDFs in a batch, after unpacking zip archives
+BATCH_MAX_BYTES = int(os.environ.get('REGION_TRIBS_BATCH_MAX_BYTES', 256 * 1024 * 1024))
+
+# Resident memory ceiling in bytes, checked between pages; a request that crosses it fails with
+# a MemoryLimitExceeded error instead of the instance being OOM killed. 0 disables the check.
+MEMORY_LIMIT_BYTES = int(os.environ.get('REGION_TRIBS_MEMORY_LIMIT', 0))
+
+# A running background job whose worker hasn't recorded a page for this many seconds is
+# considered abandoned and can be claimed again, see tools.job_store
+JOB_LEASE_SECONDS = int(os.environ.get('REGION_TRIBS_JOB_LEASE', 15 * 60))
+# Jobs, uploaded PDF included, are deleted once they haven't been updated for this many seconds.
+# 0 keeps them.
+JOB_RETENTION_SECONDS = int(os.environ.get('REGION_TRIBS_JOB_RETENTION', 7 * 24 * 60 * 60))
+
+# full: AreaElementAnalyzer.calculate_intersection_lengths output as is
+# summary: per-area wall lengths, floor areas and roof areas only
+# columnar: totals plus every area and intersection shape as flat coordinate arrays
+PROFILES = ('full', 'summary', 'columnar')
@@ -1,18 +1,248 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+import numpy as np
 import pypdf
-import pprint
-import pandas as pd
-from shapely.geometry import LineString, Polygon, mapping
-from shapely.affinity import rotate
-from shapely import transform
-from collections import defaultdict
+import shapely
+from shapely.geometry import LineString, mapping
+from shapely import transform, STRtree
+from collections import defaultdict, namedtuple
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from tools.instrumentation import MemoryLimitExceeded, check_memory, count, stage
+from tools.region_tribs_settings import (
+    BATCH_CONCURRENCY, MEMORY_LIMIT_BYTES, PARALLEL_MIN_PAGES, PARALLEL_WORKERS, SPOOL_THRESHOLD_BYTES)
+
+logger = logging.getLogger('region_tribs.pipeline')
+
+
+AnnotationRecord = namedtuple('AnnotationRecord', [
+    'subtype', 'subject', 'contents', 'coords', 'rotation', 'prefix', 'label'])
+
+
+class Annotation:
+    """
+    A Line, PolyLine or Polygon annotation as extracted for the analyzer.
+    coords is an (n, 2) float array in feet. The extractor hands out views into one array holding
+    every point of the page, and the analyzer builds its geometries from them without copying
+    them into Python tuples. prefix and label are parsed from the subject once.
+    to_dict and from_dict convert to and from the extract_real_world_coordinates dicts.
+    """
+    __slots__ = ('type', 'subject', 'contents', 'coords', 'prefix', 'label')
+
+    def __init__(self, subtype, subject, contents, coords, prefix, label):
+        self.type = subtype
+        self.subject = subject
+        self.contents = contents
+        self.coords = coords
+        self.prefix = prefix
+        self.label = label
+
+    def __repr__(self):
+        return f'Annotation({self.type!r}, {self.subject!r}, {len(self.coords)} points)'
+
+    @classmethod
+    def from_dict(cls, annotation):
+        # the prefix and label are parsed from the subject for hand-built annotations
+        if 'prefix' in annotation:
+            prefix, label = annotation['prefix'], annotation['label']
+        else:
+            prefix, label = AnnotationIndex.parse_subject(annotation.get('subject', ''))
+        coords = np.asarray(annotation.get('coords', []), dtype=float).reshape(-1, 2)
+        return cls(annotation.get('type'), annotation.get('subject'), annotation.get('contents'),
+                   coords, prefix, label)
+
+    def to_dict(self):
+        return {
+            "type": self.type,
+            "subject": self.subject,
+            "contents": self.contents,
+            "coords": list(zip(self.coords[:, 0].tolist(), self.coords[:, 1].tolist())),
+            "prefix": self.prefix,
+            "label": self.label
+        }
+
+
+def page_data_to_dict(page_data):
+    # extract_annotations output -> extract_real_world_coordinates output
+    if page_data is None:
+        return None
+    return dict(page_data, annotations=[annotation.to_dict() for annotation in page_data['annotations']])
+
+
+# Reasons a page is skipped by the pre-screen, see AnnotationIndex.screen
+SKIP_NO_ANNOTATIONS = 'no_annotations'
+SKIP_NO_SCALE = 'no_scale'
+SKIP_NO_REGIONS = 'no_regions'
+
+
+class PageSelectionError(ValueError):
+    """The requested pages are malformed or outside the document."""
+
+
+def select_pages(pages, number_of_pages):
+    """
+    Return the sorted 0-based page numbers selected by pages, either a string of 1-based pages
+    and ranges such as "1-3,7,10-" or an iterable of 1-based page numbers. None selects every page.
+    """
+    if pages is None:
+        return list(range(number_of_pages))
+    if isinstance(pages, str):
+        parts = [part.strip() for part in pages.split(',') if part.strip()]
+        if not parts:
+            raise PageSelectionError("No pages selected")
+        selected = set()
+        for part in parts:
+            start, dash, end = part.partition('-')
+            try:
+                first = int(start) if start.strip() else 1
+                last = (int(end) if end.strip() else number_of_pages) if dash else first
+            except ValueError:
+                raise PageSelectionError(f"Invalid page range '{part}'") from None
+            if first > last:
+                raise PageSelectionError(f"Invalid page range '{part}'")
+            selected.update(range(first, last + 1))
+    else:
+        selected = set(pages)
+        if not selected:
+            raise PageSelectionError("No pages selected")
+
+    if min(selected) < 1 or max(selected) > number_of_pages:
+        raise PageSelectionError(f"Pages must be between 1 and {number_of_pages}")
+    return sorted(page - 1 for page in selected)
+
+
+class AnnotationIndex:
+    """
+    Resolves a page's /Annots array in a single pass.
+    Each annotation is dereferenced once and kept as an AnnotationRecord, grouped by
+    subject and subject prefix (A, F, R, W).
+    """
+    SHAPE_SUBTYPES = ('/Line', '/PolyLine', '/Polygon')
+
+    def __init__(self, annotations):
+        self.records = []
+        self.shapes = []  # Line/PolyLine/Polygon annotations other than SCALE, in page order
+        self.by_subject = defaultdict(list)
+        self.by_prefix = defaultdict(list)
+
+        if not annotations:
+            return
+        resolved_annotations = annotations.get_object() if isinstance(
+            annotations, pypdf.generic.IndirectObject) else annotations
+        for annot_ref in resolved_annotations:
+            self.add(annot_ref.get_object())
+
+    @staticmethod
+    def parse_subject(subject):
+        # "A: Region 1" -> ("A", "Region 1"); (None, None) for other subjects, e.g. "Reviewed:JM"
+        prefix, separator, label = subject.partition(': ')
+        if not separator or len(prefix) != 1:
+            return None, None
+        return prefix, label
+
+    def add(self, annot):
+        subtype = annot.get('/Subtype')
+        subject = annot.get('/Subj') or "None"
+        contents = annot.get('/Contents') or "None"
+        coords = annot.get('/L') if subtype == '/Line' else annot.get('/Vertices')
+        prefix, label = self.parse_subject(subject)
+        record = AnnotationRecord(subtype, subject, contents, coords,
+                                  annot.get('/Rotation', 0), prefix, label)
+
+        self.records.append(record)
+        self.by_subject[subject].append(record)
+        if prefix is not None:
+            self.by_prefix[prefix].append(record)
+        if subtype in self.SHAPE_SUBTYPES and subject != "SCALE":
+            self.shapes.append(record)
+
+    def first(self, subject):
+        records = self.by_subject.get(subject)
+        return records[0] if records else None
+
+    def skip_reason(self):
+        # the same verdict as screen, for a page that has already been indexed
+        if not self.records:
+            return SKIP_NO_ANNOTATIONS
+        if self.first("SCALE") is None:
+            return SKIP_NO_SCALE
+        if not self.by_prefix.get('A'):
+            return SKIP_NO_REGIONS
+        return None
+
+    @classmethod
+    def screen(cls, annotations):
+        """
+        Decide whether a page is worth extracting by reading only the subjects of its /Annots.
+        Returns SKIP_NO_ANNOTATIONS, SKIP_NO_SCALE or SKIP_NO_REGIONS, or None for a page with a
+        SCALE line and at least one A: region. Stops reading as soon as both have been seen.
+        """
+        if not annotations:
+            return SKIP_NO_ANNOTATIONS
+        resolved_annotations = annotations.get_object() if isinstance(
+            annotations, pypdf.generic.IndirectObject) else annotations
+        if not resolved_annotations:
+            return SKIP_NO_ANNOTATIONS
+
+        has_scale = has_region = False
+        for annot_ref in resolved_annotations:
+            subject = annot_ref.get_object().get('/Subj') or "None"
+            if subject == "SCALE":
+                has_scale = True
+            elif not has_region and cls.parse_subject(subject)[0] == 'A':
+                has_region = True
+            if has_scale and has_region:
+                return None
+        return SKIP_NO_REGIONS if has_scale else SKIP_NO_SCALE
 
 
 class AnnotationsExtractor:
-    def __init__(self, pdf_path):
-        self.pdf_path = pdf_path
+    def __init__(self, source, spool_threshold=SPOOL_THRESHOLD_BYTES):
+        """
+        source is a file path, the PDF bytes (bytes, bytearray or memoryview) or a binary stream.
+        Seekable streams are read in place; other streams are spooled to memory, or to a
+        temporary file once they grow past spool_threshold bytes.
+        """
+        self.pdf_path = source if isinstance(source, (str, os.PathLike)) else None
         # Default scale factor assuming 1 inch = 72 points (72 DPI)
         self.scale_factor = 1
-        self.pdf_reader = pypdf.PdfReader(open(self.pdf_path, 'rb'))
+        self.stream, self.owns_stream = self.open_source(source, spool_threshold)
+        with stage('pdf_parse'):
+            self.pdf_reader = pypdf.PdfReader(self.stream)
+        self.annotation_indexes = {}
+        self.skip_reasons = {}
+        self.weight_criteria = {}  # parsed EFFECTIVE SEISMIC WEIGHT CRITERIA of extracted pages
+
+    @staticmethod
+    def open_source(source, spool_threshold=SPOOL_THRESHOLD_BYTES):
+        # returns the stream and whether the extractor is responsible for closing it
+        if isinstance(source, (str, os.PathLike)):
+            return open(source, 'rb'), True
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return io.BytesIO(source), True
+        if source.seekable():
+            source.seek(0)
+            return source, False
+
+        spooled = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        shutil.copyfileobj(source, spooled)
+        spooled.seek(0)
+        return spooled, True
+
+    def close(self):
+        if self.owns_stream:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     @staticmethod
     def parse_scale_line_inches(scale_content, dpi=72):
@@ -58,93 +288,176 @@ class AnnotationsExtractor:
     @staticmethod
     # coordinates given in feet
     def convert_to_real_world_coords_xy_pairs(coords, scale_factor):
-        return [(float(coords[i]) * scale_factor / 12, float(coords[i + 1]) * scale_factor / 12) for i in range(0, len(coords), 2)]
+        points = np.asarray(coords, dtype=float).reshape(-1, 2) * scale_factor / 12
+        return list(zip(points[:, 0].tolist(), points[:, 1].tolist()))
+
+    @staticmethod
+    def rotate_polygon_coords(points, offsets, rotations):
+        """
+        Rotate many polygons about their bounding box centers in one pass, matching
+        shapely.affinity.rotate(polygon, -rotation, origin='center').
+        points is an (n, 2) array of every polygon's vertices, offsets[i]:offsets[i + 1] the rows
+        of polygon i, and rotations the rotation of each polygon in degrees.
+        """
+        counts = np.diff(offsets)
+        starts = offsets[:-1]
+        angle = -np.asarray(rotations, dtype=float) * np.pi / 180.0
+        cosp = np.cos(angle)
+        sinp = np.sin(angle)
+        cosp[np.abs(cosp) < 2.5e-16] = 0.0
+        sinp[np.abs(sinp) < 2.5e-16] = 0.0
+
+        x0 = (np.minimum.reduceat(points[:, 0], starts) +
+              np.maximum.reduceat(points[:, 0], starts)) / 2.0
+        y0 = (np.minimum.reduceat(points[:, 1], starts) +
+              np.maximum.reduceat(points[:, 1], starts)) / 2.0
+        xoff = x0 - x0 * cosp + y0 * sinp
+        yoff = y0 - x0 * sinp - y0 * cosp
+
+        # per-vertex copies of each polygon's rotation
+        cosp, sinp, xoff, yoff = (np.repeat(value, counts) for value in (cosp, sinp, xoff, yoff))
+        x, y = points[:, 0], points[:, 1]
+        return np.stack([cosp * x + -sinp * y + xoff, sinp * x + cosp * y + yoff], axis=1)
 
     def get_number_of_pages(self):
         return len(self.pdf_reader.pages)
 
+    def release_page(self, page_number):
+        # drop the page's index and the PDF objects pypdf resolved for it; they are
+        # parsed again from the file if they are needed later
+        self.annotation_indexes.pop(page_number, None)
+        self.pdf_reader.resolved_objects.clear()
+
+    def screen_page(self, page_number):  # 0 is page 1
+        # see AnnotationIndex.screen; uses the page's index instead when it has been built
+        if page_number not in self.skip_reasons:
+            if page_number in self.annotation_indexes:
+                self.skip_reasons[page_number] = self.annotation_indexes[page_number].skip_reason()
+            else:
+                with stage('screen'):
+                    self.skip_reasons[page_number] = AnnotationIndex.screen(
+                        self.pdf_reader.pages[page_number].get('/Annots'))
+        return self.skip_reasons[page_number]
+
+    def get_weight_criteria(self, page_number):  # 0 is page 1
+        """
+        The page's parsed EFFECTIVE SEISMIC WEIGHT CRITERIA, or None when it has none.
+        Only the annotation subjects are read, unless the page has already been indexed or extracted.
+        """
+        if page_number in self.weight_criteria:
+            return self.weight_criteria[page_number]
+        if page_number in self.annotation_indexes:
+            criteria = self.annotation_indexes[page_number].first("EFFECTIVE SEISMIC WEIGHT CRITERIA")
+            contents = criteria.contents if criteria is not None else None
+        else:
+            contents = None
+            annotations = self.pdf_reader.pages[page_number].get('/Annots')
+            for annot_ref in (annotations.get_object() if annotations is not None else []):
+                annot = annot_ref.get_object()
+                if annot.get('/Subj') == "EFFECTIVE SEISMIC WEIGHT CRITERIA":
+                    contents = annot.get('/Contents') or "None"
+                    break
+        return self.parse_effective_seismic_weight_criteria(contents) if contents is not None else None
+
+    def screen_pages(self, page_numbers):
+        """Return {1-based page number: reason} for the given pages that the pre-screen skips."""
+        skipped = {}
+        for page_number in page_numbers:
+            reason = self.screen_page(page_number)
+            if reason is not None:
+                skipped[page_number + 1] = reason
+            # screening a page resolves its annotations, don't keep them around for the whole document
+            self.pdf_reader.resolved_objects.clear()
+        count('skipped_pages', len(skipped))
+        return skipped
+
+    def get_annotation_index(self, page_number):  # 0 is page 1
+        if page_number not in self.annotation_indexes:
+            with stage('annotations'):
+                page = self.pdf_reader.pages[page_number]
+                self.annotation_indexes[page_number] = AnnotationIndex(
+                    page.get('/Annots'))
+            count('annotations', len(self.annotation_indexes[page_number].records))
+        return self.annotation_indexes[page_number]
+
     def extract_real_world_coordinates(self, page_number):  # 0 is page 1
+        """
+        The page's scale factor, weight criteria and shape annotations in feet, with every
+        annotation as a dict, or None for pages that can't be analyzed.
+        """
+        page_data = self.extract_annotations(page_number)
+        with stage('extract'):
+            return page_data_to_dict(page_data)
+
+    def extract_annotations(self, page_number):  # 0 is page 1
+        # extract_real_world_coordinates with the annotations as Annotation records
         if page_number < 0 or page_number >= len(self.pdf_reader.pages):
             return None
+        # pages without annotations or without a SCALE line come out as None anyway
+        if self.screen_page(page_number) in (SKIP_NO_ANNOTATIONS, SKIP_NO_SCALE):
+            return None
+
+        index = self.get_annotation_index(page_number)
+        with stage('extract'):
+            return self.extract_from_index(index, page_number)
 
-        page = self.pdf_reader.pages[page_number]
-        annotations = page.get('/Annots')
+    def extract_from_index(self, index, page_number):  # 0 is page 1
         result = {"page_metadata": {
             "page_number": page_number + 1}, "annotations": []}
 
         # if page doesn't have annotations, skip it
-        if not annotations:
+        if not index.records:
             return None
 
-        # go through the annotations to set the scale factor first before processing the rest
+        # set the scale factor first before processing the rest
         # if there is no scale found, skip the page
-        if annotations:
-            resolved_annotations = annotations.get_object() if isinstance(
-                annotations, pypdf.generic.IndirectObject) else annotations
-            has_scale = False
-            for annot_ref in resolved_annotations:
-                annot = annot_ref.get_object()
-                subject = annot.get('/Subj') or "None"
-                contents = annot.get('/Contents') or "None"
-                if subject == "SCALE":
-                    linecoords = annot.get('/L')
-                    pdf_unit_length = LineString([(linecoords[0], linecoords[1]),
-                                                  (linecoords[2], linecoords[3])]).length
-                    self.scale_factor = self.parse_scale_line_inches(
-                        contents)/pdf_unit_length
-                    has_scale = True
-                    break
-            if not has_scale:
-                return None
+        scale = index.first("SCALE")
+        if scale is None:
+            return None
+        linecoords = scale.coords
+        pdf_unit_length = LineString([(linecoords[0], linecoords[1]),
+                                      (linecoords[2], linecoords[3])]).length
+        self.scale_factor = self.parse_scale_line_inches(
+            scale.contents)/pdf_unit_length
         result['page_metadata']['scale_factor'] = self.scale_factor
 
         # process lines, polylines, polygons
-        if annotations:
-            resolved_annotations = annotations.get_object() if isinstance(
-                annotations, pypdf.generic.IndirectObject) else annotations
-            for annot_ref in resolved_annotations:
-                annot = annot_ref.get_object()
-                subtype = annot.get('/Subtype')
-                subject = annot.get('/Subj') or "None"
-                contents = annot.get('/Contents') or "None"
-                rotation_deg = annot.get('/Rotation', 0)
-
-                if subject == "SCALE":
-                    continue
-
-                if subtype in ['/Line', '/PolyLine', '/Polygon']:
-                    coords = annot.get(
-                        '/L') if subtype == '/Line' else annot.get('/Vertices')
-                    real_world_coords = self.convert_to_real_world_coords_xy_pairs(
-                        coords, self.scale_factor)
-                    # account for rotations of polygons
-                    # lines and polylines don't have a rotation
-                    if subtype != '/Line' and rotation_deg != 0:
-                        shape = Polygon(real_world_coords)
-                        rotated_shape = rotate(
-                            shape, -1*rotation_deg, origin='center')
-                        # ignore the last coord. it's a repeat of the first
-                        real_world_coords = list(
-                            rotated_shape.exterior.coords[:-1])
-                    result["annotations"].append({
-                        "type": subtype[1:],
-                        "subject": subject,
-                        "contents": contents,
-                        "coords": real_world_coords
-                    })
+        # every shape's coordinates are scaled (and rotated) together as one array
+        shapes = index.shapes
+        if shapes:
+            flat_coords = np.fromiter(chain.from_iterable(
+                record.coords for record in shapes), dtype=float)
+            points = flat_coords.reshape(-1, 2) * self.scale_factor / 12
+            offsets = np.zeros(len(shapes) + 1, dtype=np.intp)
+            np.cumsum([len(record.coords) // 2 for record in shapes], out=offsets[1:])
+
+            # account for rotations of polygons
+            # lines and polylines don't have a rotation
+            rotated = [i for i, record in enumerate(shapes)
+                       if record.subtype != '/Line' and record.rotation != 0]
+            if rotated:
+                rows = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in rotated])
+                rotated_offsets = np.zeros(len(rotated) + 1, dtype=np.intp)
+                np.cumsum(np.diff(offsets)[rotated], out=rotated_offsets[1:])
+                points[rows] = self.rotate_polygon_coords(
+                    points[rows], rotated_offsets, [shapes[i].rotation for i in rotated])
+
+            rotated = set(rotated)
+            for i, (record, start, end) in enumerate(zip(shapes, offsets[:-1].tolist(), offsets[1:].tolist())):
+                # a closed polygon repeats its first vertex at the end; rotation drops the repeat
+                if i in rotated and end - start > 1 and (points[start] == points[end - 1]).all():
+                    end -= 1
+                result["annotations"].append(Annotation(
+                    record.subtype[1:], record.subject, record.contents, points[start:end],
+                    record.prefix, record.label))
 
         # get the effective seismic weight criteria
-        if annotations:
-            resolved_annotations = annotations.get_object() if isinstance(
-                annotations, pypdf.generic.IndirectObject) else annotations
-            for annot_ref in resolved_annotations:
-                annot = annot_ref.get_object()
-                subject = annot.get('/Subj') or "None"
-                contents = annot.get('/Contents') or "None"
-                if subject == "EFFECTIVE SEISMIC WEIGHT CRITERIA":
-                    result['page_metadata']['weight_criteria'] = self.parse_effective_seismic_weight_criteria(
-                        contents)
-                    break
+        # kept after the page is released, see get_weight_criteria
+        criteria = index.first("EFFECTIVE SEISMIC WEIGHT CRITERIA")
+        self.weight_criteria[page_number] = None if criteria is None else \
+            self.parse_effective_seismic_weight_criteria(criteria.contents)
+        if criteria is not None:
+            result['page_metadata']['weight_criteria'] = self.weight_criteria[page_number]
 
         return result
 
@@ -188,24 +501,98 @@ class AreaElementAnalyzer:
             # last point of a polygon is a repeat of the first
             return coords[0][:-1]
 
+    @classmethod
+    def to_xy_coords_many(cls, geoms, scale_factor):
+        """
+        Vectorized to_xy_coords for an array of geometries.
+        Returns the real-world and the PDF document coordinates of every geometry.
+        LineStrings and Polygons are handled in one get_coordinates call; any other geometry
+        type (e.g. a MultiLineString intersection) goes through to_xy_coords.
+        """
+        geoms = np.asarray(geoms, dtype=object)
+        real_coords = [None] * len(geoms)
+        pdf_coords = [None] * len(geoms)
+        if not len(geoms):
+            return real_coords, pdf_coords
+
+        type_ids = shapely.get_type_id(geoms)
+        is_polygon = type_ids == shapely.GeometryType.POLYGON
+        is_simple = is_polygon | (type_ids == shapely.GeometryType.LINESTRING)
+        simple_rows = np.flatnonzero(is_simple)
+
+        if len(simple_rows):
+            lines = np.where(is_polygon, shapely.get_exterior_ring(geoms), geoms)[simple_rows]
+            points = shapely.get_coordinates(lines)
+            offsets = np.zeros(len(simple_rows) + 1, dtype=np.intp)
+            np.cumsum(shapely.get_num_coordinates(lines), out=offsets[1:])
+            ends = offsets[1:].copy()
+            # last point of a polygon is a repeat of the first
+            ends[is_polygon[simple_rows]] -= 1
+
+            real_points = points.tolist()
+            pdf_points = (points * (12 / scale_factor)).tolist()
+            for row, start, end in zip(simple_rows.tolist(), offsets[:-1].tolist(), ends.tolist()):
+                real_coords[row] = real_points[start:end]
+                pdf_coords[row] = pdf_points[start:end]
+
+        for row in np.flatnonzero(~is_simple).tolist():
+            real_coords[row] = cls.to_xy_coords(geoms[row])
+            pdf_coords[row] = cls.to_xy_coords(
+                cls.scale_linestring(geoms[row], scale_factor))
+
+        return real_coords, pdf_coords
+
+    @staticmethod
+    def build_geometries(coords_list, geometry_type):
+        # one Shapely call for all annotations of an element class
+        if not coords_list:
+            return np.empty(0, dtype=object)
+        counts = [len(coords) for coords in coords_list]
+        if all(isinstance(coords, np.ndarray) for coords in coords_list):
+            points = np.concatenate(coords_list)
+        else:
+            # lists of (x, y) pairs from dict annotations
+            points = np.fromiter(chain.from_iterable(chain.from_iterable(coords_list)),
+                                 dtype=float).reshape(-1, 2)
+        indices = np.repeat(np.arange(len(coords_list)), counts)
+        if geometry_type == 'LineString':
+            return shapely.linestrings(points, indices=indices)
+        return shapely.polygons(shapely.linearrings(points, indices=indices))
+
     def process_data(self):
         # Separate the annotations by their prefix
+        grouped = {'A': ([], []), 'F': ([], []), 'R': ([], []), 'W': ([], [])}
         for annotation in self.data.get('annotations', []):
-            subject = annotation.get('subject', '')
-            if ':' in subject:
-                prefix, label = subject.split(': ')
-                coords = [tuple(coord)
-                          for coord in annotation.get('coords', [])]
-                if prefix == 'A':
-                    self.areas.append((label, Polygon(coords)))
-                elif prefix == 'F':
-                    self.floors.append((label, Polygon(coords)))
-                elif prefix == 'R':
-                    self.roofs.append((label, Polygon(coords)))
-                elif prefix == 'W':
-                    self.walls.append((label, LineString(coords)))
-
-    def calculate_intersection_lengths(self):
+            # Annotation records share the extractor's coordinate arrays; for dicts
+            # (extract_real_world_coordinates output, or built by hand) the prefix and label
+            # are parsed from the subject when they're missing
+            if isinstance(annotation, Annotation):
+                prefix, label, coords = annotation.prefix, annotation.label, annotation.coords
+            else:
+                if 'prefix' in annotation:
+                    prefix, label = annotation['prefix'], annotation['label']
+                else:
+                    prefix, label = AnnotationIndex.parse_subject(
+                        annotation.get('subject', ''))
+                coords = annotation.get('coords', [])
+            if prefix in grouped:
+                labels, coords_list = grouped[prefix]
+                labels.append(label)
+                coords_list.append(coords)
+
+        # Shapely geometry arrays per element class, parallel to the (label, geometry) lists
+        self.geometries = {
+            'areas': self.build_geometries(grouped['A'][1], 'Polygon'),
+            'floors': self.build_geometries(grouped['F'][1], 'Polygon'),
+            'roofs': self.build_geometries(grouped['R'][1], 'Polygon'),
+            'walls': self.build_geometries(grouped['W'][1], 'LineString'),
+        }
+        self.areas = list(zip(grouped['A'][0], self.geometries['areas']))
+        self.floors = list(zip(grouped['F'][0], self.geometries['floors']))
+        self.roofs = list(zip(grouped['R'][0], self.geometries['roofs']))
+        self.walls = list(zip(grouped['W'][0], self.geometries['walls']))
+
+    def _new_area_analysis(self, scale_factor):
         # Dictionary to store the calculated lengths, areas, and intersection shapes
         area_analysis = defaultdict(lambda: {
             'wall_lengths': defaultdict(float),
@@ -216,10 +603,11 @@ class AreaElementAnalyzer:
             'roof_intersections': defaultdict(list)
         })
 
-        scale_factor = self.data.get('page_metadata')['scale_factor']
+        real_coords, pdf_coords = self.to_xy_coords_many(
+            self.geometries['areas'], scale_factor)
 
         # Initialize all areas with all wall, floor, and roof types
-        for area_label, area_polygon in self.areas:
+        for i, (area_label, area_polygon) in enumerate(self.areas):
             for wall_label, _ in self.walls:
                 area_analysis[area_label]['wall_lengths'][wall_label] = 0.0
                 area_analysis[area_label]['wall_intersections'][wall_label] = []
@@ -229,45 +617,257 @@ class AreaElementAnalyzer:
             for roof_label, _ in self.roofs:
                 area_analysis[area_label]['roof_areas'][roof_label] = 0.0
                 area_analysis[area_label]['roof_intersections'][roof_label] = []
-            area_analysis[area_label]['realCoords'] = self.to_xy_coords(
-                area_polygon),
-            area_analysis[area_label]['PDFCoords'] = self.to_xy_coords(
-                self.scale_linestring(area_polygon, scale_factor))
+            area_analysis[area_label]['realCoords'] = real_coords[i]
+            area_analysis[area_label]['PDFCoords'] = pdf_coords[i]
+
+        return area_analysis
+
+    @staticmethod
+    def _add_intersection(area_analysis, area_label, kind, label, measure, real_coords, pdf_coords):
+        # kind is 'wall' (measure is a length) or 'floor'/'roof' (measure is an area)
+        totals_key, measure_key = ('wall_lengths', 'length') if kind == 'wall' else (
+            kind + '_areas', 'area')
+        area_analysis[area_label][totals_key][label] += measure
+        area_analysis[area_label][kind + '_intersections'][label].append({
+            'realCoords': real_coords,
+            'PDFCoords': pdf_coords,
+            measure_key: measure
+        })
+
+    def calculate_intersection_lengths(self, use_spatial_index=True):
+        if not use_spatial_index:
+            return self.calculate_intersection_lengths_brute_force()
+
+        scale_factor = self.data.get('page_metadata')['scale_factor']
+        area_analysis = self._new_area_analysis(scale_factor)
+        area_geoms = self.geometries['areas']
+
+        # One STRtree per element class, queried with every area at once.
+        # Pairs are sorted so that intersections are recorded in the same order as the
+        # brute-force path. Intersection, measurement and coordinate extraction then run as
+        # one vectorized call per element class.
+        for kind, elements, element_geoms in (('wall', self.walls, self.geometries['walls']),
+                                              ('floor', self.floors, self.geometries['floors']),
+                                              ('roof', self.roofs, self.geometries['roofs'])):
+            if not len(area_geoms) or not len(element_geoms):
+                continue
+            area_rows, element_rows = STRtree(element_geoms).query(
+                area_geoms, predicate='intersects')
+            order = np.lexsort((element_rows, area_rows))
+            area_rows, element_rows = area_rows[order], element_rows[order]
+
+            intersections = shapely.intersection(
+                area_geoms[area_rows], element_geoms[element_rows])
+            measures = (shapely.length(intersections) if kind == 'wall'
+                        else shapely.area(intersections)).tolist()
+            real_coords, pdf_coords = self.to_xy_coords_many(intersections, scale_factor)
+
+            for i, (area_row, element_row) in enumerate(zip(area_rows.tolist(), element_rows.tolist())):
+                self._add_intersection(
+                    area_analysis, self.areas[area_row][0], kind, elements[element_row][0],
+                    measures[i], real_coords[i], pdf_coords[i])
+
+        self.area_analysis = area_analysis
+        return area_analysis
+
+    def _add_brute_force_intersection(self, area_analysis, area_label, kind, label, intersection, scale_factor):
+        measure = intersection.length if kind == 'wall' else intersection.area
+        self._add_intersection(
+            area_analysis, area_label, kind, label, measure,
+            self.to_xy_coords(intersection),
+            self.to_xy_coords(self.scale_linestring(intersection, scale_factor)))
+
+    def calculate_intersection_lengths_brute_force(self):
+        scale_factor = self.data.get('page_metadata')['scale_factor']
+        area_analysis = self._new_area_analysis(scale_factor)
 
         # Calculating intersections for each area with walls, floors, and roofs
         for area_label, area_polygon in self.areas:
             for wall_label, wall_line in self.walls:
                 if area_polygon.intersects(wall_line):
-                    intersection = area_polygon.intersection(wall_line)
-                    intersection_length = intersection.length
-                    area_analysis[area_label]['wall_lengths'][wall_label] += intersection_length
-                    area_analysis[area_label]['wall_intersections'][wall_label].append({
-                        'realCoords': self.to_xy_coords(intersection),
-                        'PDFCoords': self.to_xy_coords(self.scale_linestring(intersection, scale_factor)),
-                        'length': intersection_length
-                    })
+                    self._add_brute_force_intersection(
+                        area_analysis, area_label, 'wall', wall_label,
+                        area_polygon.intersection(wall_line), scale_factor)
 
             for floor_label, floor_polygon in self.floors:
                 if area_polygon.intersects(floor_polygon):
-                    intersection = area_polygon.intersection(floor_polygon)
-                    intersection_area = intersection.area
-                    area_analysis[area_label]['floor_areas'][floor_label] += intersection_area
-                    area_analysis[area_label]['floor_intersections'][floor_label].append({
-                        'realCoords': self.to_xy_coords(intersection),
-                        'PDFCoords': self.to_xy_coords(self.scale_linestring(intersection, scale_factor)),
-                        'area': intersection_area
-                    })
+                    self._add_brute_force_intersection(
+                        area_analysis, area_label, 'floor', floor_label,
+                        area_polygon.intersection(floor_polygon), scale_factor)
 
             for roof_label, roof_polygon in self.roofs:
                 if area_polygon.intersects(roof_polygon):
-                    intersection = area_polygon.intersection(roof_polygon)
-                    intersection_area = intersection.area
-                    area_analysis[area_label]['roof_areas'][roof_label] += intersection_area
-                    area_analysis[area_label]['roof_intersections'][roof_label].append({
-                        'realCoords': self.to_xy_coords(intersection),
-                        'PDFCoords': self.to_xy_coords(self.scale_linestring(intersection, scale_factor)),
-                        'area': intersection_area
-                    })
+                    self._add_brute_force_intersection(
+                        area_analysis, area_label, 'roof', roof_label,
+                        area_polygon.intersection(roof_polygon), scale_factor)
 
         self.area_analysis = area_analysis
         return area_analysis
+
+
+# ========= Page pipeline
+
+_worker_extractor = None
+_worker_memory_limit = 0
+
+
+def to_plain_dict(value):
+    # defaultdicts built with lambdas can't be pickled back from a worker process
+    if isinstance(value, dict):
+        return {key: to_plain_dict(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_plain_dict(item) for item in value]
+    return value
+
+
+def analyze_page_data(page_data):
+    # page_data is the output of AnnotationsExtractor.extract_annotations or extract_real_world_coordinates
+    count('pages')
+    if not page_data:
+        return None
+    with stage('analyze'):
+        analyzer = AreaElementAnalyzer(page_data)
+        area_analysis = analyzer.calculate_intersection_lengths()
+    count('areas', len(analyzer.areas))
+    return area_analysis
+
+
+def analyze_page(extractor, page_number):
+    # a SCALE line without regions analyzes to no areas, no need to extract the page
+    if extractor.screen_page(page_number) == SKIP_NO_REGIONS:
+        return {}
+    return analyze_page_data(extractor.extract_annotations(page_number))
+
+
+def iter_analyzed_pages(extractor, page_numbers, memory_limit=None, page_data=None):
+    """
+    Analyze the given pages one at a time, yielding (page_number, area_analysis).
+    Each page is released before the next one is read and the process's RSS is checked against
+    memory_limit bytes (MEMORY_LIMIT_BYTES when None) in between.
+    When page_data is a dict, it also receives each page's extract_real_world_coordinates output
+    by page number; pages with a SCALE line but no regions are then extracted as well.
+    """
+    memory_limit = MEMORY_LIMIT_BYTES if memory_limit is None else memory_limit
+    for page_number in page_numbers:
+        if page_data is None:
+            area_analysis = analyze_page(extractor, page_number)
+        else:
+            annotations = extractor.extract_annotations(page_number)
+            page_data[page_number] = page_data_to_dict(annotations)
+            area_analysis = analyze_page_data(annotations)
+        extractor.release_page(page_number)
+        check_memory(memory_limit)
+        yield page_number, area_analysis
+
+
+def _init_worker(source, memory_limit=0):
+    global _worker_extractor, _worker_memory_limit
+    _worker_extractor = AnnotationsExtractor(source)
+    _worker_memory_limit = memory_limit
+
+
+def _analyze_page_in_worker(page_number):
+    # the page's weight criteria travel back with its analysis, see process_pages
+    area_analysis = to_plain_dict(analyze_page(_worker_extractor, page_number))
+    _worker_extractor.release_page(page_number)
+    # MemoryLimitExceeded is re-raised in the parent by executor.map
+    check_memory(_worker_memory_limit)
+    return area_analysis, _worker_extractor.weight_criteria.get(page_number)
+
+
+def process_pages(source, workers=None, min_pages_for_parallel=None, pages=None, skipped=None,
+                  memory_limit=None, weight_criteria=None):
+    """
+    Extract and analyze the PDF's pages, returning one entry per page in page order.
+    Pages without a SCALE annotation, and pages left out of pages (see select_pages), are None;
+    pages with a SCALE annotation but no A: regions are empty.
+    source is anything AnnotationsExtractor accepts.
+    Selected pages are pre-screened first and only the ones with regions are extracted; when
+    skipped is a dict it receives {1-based page number: reason} for the screened out pages.
+    When weight_criteria is a dict it receives {1-based page number: parsed weight criteria, or
+    None} for the analyzed pages, as read during extraction.
+    Each worker process opens its own PdfReader once and analyzes a share of the pages.
+    memory_limit (MEMORY_LIMIT_BYTES when None) is checked between pages, see iter_analyzed_pages;
+    with a process pool the parent and every worker process are each held to it.
+    """
+    memory_limit = MEMORY_LIMIT_BYTES if memory_limit is None else memory_limit
+    workers = PARALLEL_WORKERS if workers is None else workers
+    workers = workers or os.cpu_count() or 1
+    if min_pages_for_parallel is None:
+        min_pages_for_parallel = PARALLEL_MIN_PAGES
+
+    with AnnotationsExtractor(source) as extractor:
+        number_of_pages = extractor.get_number_of_pages()
+        page_numbers = select_pages(pages, number_of_pages)
+        screened = extractor.screen_pages(page_numbers)
+        if skipped is not None:
+            skipped.update(screened)
+
+        results = [None] * number_of_pages
+        for page_number, reason in screened.items():
+            if reason == SKIP_NO_REGIONS:
+                results[page_number - 1] = {}
+        page_numbers = [page_number for page_number in page_numbers if page_number + 1 not in screened]
+        workers = min(workers, len(page_numbers))
+
+        if workers > 1 and len(page_numbers) >= min_pages_for_parallel:
+            # workers get the path, or the raw bytes when the PDF only exists in memory
+            worker_source = extractor.pdf_path
+            if worker_source is None:
+                extractor.stream.seek(0)
+                worker_source = extractor.stream.read()
+            try:
+                # stage timings of the workers aren't collected, only the pool as a whole
+                with stage('page_pool'), ProcessPoolExecutor(
+                        max_workers=workers, initializer=_init_worker,
+                        initargs=(worker_source, memory_limit)) as executor:
+                    chunksize = max(1, len(page_numbers) // (workers * 4))
+                    analyzed = executor.map(_analyze_page_in_worker, page_numbers, chunksize=chunksize)
+                    try:
+                        for page_number, (area_analysis, criteria) in zip(page_numbers, analyzed):
+                            results[page_number] = area_analysis
+                            if weight_criteria is not None:
+                                weight_criteria[page_number + 1] = criteria
+                            check_memory(memory_limit)
+                    except MemoryLimitExceeded:
+                        # don't start the pages that are still queued
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        raise
+                    return results
+            except (OSError, NotImplementedError, BrokenProcessPool) as e:
+                # e.g. no /dev/shm for the pool's semaphores on some serverless runtimes
+                logger.warning("Process pool unavailable, processing pages serially: %s", e)
+
+        for page_number, area_analysis in iter_analyzed_pages(extractor, page_numbers, memory_limit):
+            results[page_number] = area_analysis
+            if weight_criteria is not None:
+                weight_criteria[page_number + 1] = extractor.weight_criteria.get(page_number)
+        return results
+
+
+def _process_document(source):
+    # (pages, skipped, None) on success, (None, None, error message) when the document can't be analyzed
+    try:
+        skipped = {}
+        return to_plain_dict(process_pages(source, workers=1, skipped=skipped)), skipped, None
+    except Exception as e:
+        return None, None, str(e)
+
+
+def process_documents(sources, concurrency=None):
+    """
+    Run process_pages over several PDFs, at most concurrency of them at a time in worker processes.
+    Returns one (pages, skipped, error) tuple per source, in order; a failing document doesn't
+    affect the others.
+    """
+    concurrency = BATCH_CONCURRENCY if concurrency is None else concurrency
+    concurrency = min(concurrency or os.cpu_count() or 1, len(sources))
+
+    if concurrency > 1:
+        try:
+            with stage('document_pool'), ProcessPoolExecutor(max_workers=concurrency) as executor:
+                return list(executor.map(_process_document, sources))
+        except (OSError, NotImplementedError, BrokenProcessPool) as e:
+            logger.warning("Process pool unavailable, processing documents serially: %s", e)
+
+    return [_process_document(source) for source in sources]
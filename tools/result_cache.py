@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('region_tribs.cache')
+
+
+class ResultCache:
+    """
+    Content-addressed cache for serialized PDF analysis results.
+    Entries are keyed by a hash of the uploaded bytes and the analyzer version and kept in an
+    in-memory LRU bounded by total payload size, with an optional on-disk layer (e.g. under /tmp)
+    so a warm serverless instance can serve repeats without re-running the pipeline.
+    The disk layer is bounded by disk_max_bytes; the least recently used files are deleted first.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None, disk_max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(pdf, version):
+        # pdf is the uploaded bytes or a seekable binary stream, which is rewound afterwards
+        if isinstance(pdf, (bytes, bytearray, memoryview)):
+            digest = hashlib.sha256(pdf)
+        else:
+            digest = hashlib.sha256()
+            pdf.seek(0)
+            for chunk in iter(lambda: pdf.read(1024 * 1024), b''):
+                digest.update(chunk)
+            pdf.seek(0)
+        digest.update(b'\0' + str(version).encode())
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + '.json')
+
+    def _put_in_memory(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return False
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= len(self.entries.pop(key))
+            self.entries[key] = payload
+            self.current_bytes += len(payload)
+            # evict least recently used entries until the cache fits again
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+        return True
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    payload = f.read()
+                # the modification time orders the files for eviction
+                os.utime(self._disk_path(key))
+            except OSError:
+                return None
+            self._put_in_memory(key, payload)
+            return payload
+
+        return None
+
+    def set(self, key, payload):
+        # returns False when the payload fits neither layer, so a later get() will miss
+        stored = self._put_in_memory(key, payload)
+
+        if self.disk_dir and len(payload) <= self.disk_max_bytes:
+            try:
+                # write to a temporary file first so readers never see a partial entry
+                fd, temp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(payload)
+                os.replace(temp_path, self._disk_path(key))
+                stored = True
+            except OSError as e:
+                logger.warning("Could not write cache entry %s: %s", key, e)
+            self._trim_disk()
+        return stored
+
+    def _trim_disk(self):
+        # the directory may be shared by several processes, so sizes are read from disk every time
+        files = []
+        try:
+            with os.scandir(self.disk_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json'):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:  # e.g. a file deleted by another process meanwhile
+            logger.warning("Could not list cache directory %s: %s", self.disk_dir, e)
+            return
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
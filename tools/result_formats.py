@@ -0,0 +1,105 @@
+import numpy as np
+from tools.region_tribs_settings import PROFILES
+
+TOTALS_KEYS = ('wall_lengths', 'floor_areas', 'roof_areas')
+# element kind, intersections key, measure key
+INTERSECTION_KEYS = (('wall', 'wall_intersections', 'length'),
+                     ('floor', 'floor_intersections', 'area'),
+                     ('roof', 'roof_intersections', 'area'))
+
+
+def round_coords(coords, precision):
+    if precision is None:
+        return coords
+    return np.round(np.asarray(coords, dtype=float), precision).tolist()
+
+
+def flatten_coords(coords_list, precision):
+    """
+    Encode a list of coordinate lists as offsets into one flat [x0, y0, x1, y1, ...] array.
+    offsets[i]:offsets[i + 1] are the points of shape i.
+    """
+    counts = [len(coords) for coords in coords_list]
+    offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    points = [point for coords in coords_list for point in coords]
+    flat = np.asarray(points, dtype=float).reshape(-1)
+    if precision is not None:
+        flat = np.round(flat, precision)
+    return offsets.tolist(), flat.tolist()
+
+
+def summarize_area(area, sparse=False):
+    return {key: {label: value for label, value in area[key].items() if not sparse or value}
+            for key in TOTALS_KEYS}
+
+
+def format_full(area_analysis, precision=None, sparse=False):
+    formatted = {}
+    for area_label, area in area_analysis.items():
+        formatted_area = summarize_area(area, sparse)
+        for _, intersections_key, measure_key in INTERSECTION_KEYS:
+            formatted_area[intersections_key] = {
+                label: [{
+                    'realCoords': round_coords(intersection['realCoords'], precision),
+                    'PDFCoords': round_coords(intersection['PDFCoords'], precision),
+                    measure_key: intersection[measure_key]
+                } for intersection in intersections]
+                for label, intersections in area[intersections_key].items()
+                if not sparse or intersections}
+        formatted_area['realCoords'] = round_coords(area['realCoords'], precision)
+        formatted_area['PDFCoords'] = round_coords(area['PDFCoords'], precision)
+        formatted[area_label] = formatted_area
+    return formatted
+
+
+def format_columnar(area_analysis, precision=None, sparse=False):
+    area_labels = list(area_analysis)
+    area_offsets, area_real_coords = flatten_coords(
+        [area['realCoords'] for area in area_analysis.values()], precision)
+    _, area_pdf_coords = flatten_coords(
+        [area['PDFCoords'] for area in area_analysis.values()], precision)
+
+    # one row per intersection shape
+    rows = {'area': [], 'kind': [], 'label': [], 'measure': []}
+    real_coords = []
+    pdf_coords = []
+    for area_index, area in enumerate(area_analysis.values()):
+        for kind, intersections_key, measure_key in INTERSECTION_KEYS:
+            for label, intersections in area[intersections_key].items():
+                for intersection in intersections:
+                    rows['area'].append(area_index)
+                    rows['kind'].append(kind)
+                    rows['label'].append(label)
+                    rows['measure'].append(intersection[measure_key])
+                    real_coords.append(intersection['realCoords'])
+                    pdf_coords.append(intersection['PDFCoords'])
+    rows['offsets'], rows['realCoords'] = flatten_coords(real_coords, precision)
+    _, rows['PDFCoords'] = flatten_coords(pdf_coords, precision)
+
+    return {
+        'areas': area_labels,
+        'totals': [summarize_area(area, sparse) for area in area_analysis.values()],
+        'area_offsets': area_offsets,
+        'area_realCoords': area_real_coords,
+        'area_PDFCoords': area_pdf_coords,
+        'intersections': rows
+    }
+
+
+def format_page(area_analysis, profile='full', precision=None, sparse=False):
+    if area_analysis is None:
+        return None
+    if profile == 'summary':
+        return {area_label: summarize_area(area, sparse) for area_label, area in area_analysis.items()}
+    if profile == 'columnar':
+        return format_columnar(area_analysis, precision, sparse)
+    if precision is None and not sparse:
+        return area_analysis
+    return format_full(area_analysis, precision, sparse)
+
+
+def format_pages(pages, profile='full', precision=None, sparse=False):
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown output profile '{profile}', expected one of {', '.join(PROFILES)}")
+    return [format_page(page, profile, precision, sparse) for page in pages]
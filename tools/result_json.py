@@ -0,0 +1,42 @@
+"""
+JSON encoding of analysis results.
+
+The analyzer's output is nested defaultdicts of lists of tuples of floats. orjson serializes
+that structure as is, dict subclasses and tuples included, straight to UTF-8 bytes without
+an intermediate copy. Without orjson the standard library encoder is used with the settings
+Flask's jsonify uses (sorted keys, compact separators, ASCII only), so both give the same
+document; orjson writes non-ASCII characters as UTF-8 rather than \\u escapes.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, e.g. on platforms without a wheel
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+                  if orjson is not None else 0)
+
+
+def _default(value):
+    # NumPy scalars and arrays that reach the stdlib encoder
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(value):
+    """Encode value as compact JSON bytes with sorted keys."""
+    if orjson is not None:
+        return orjson.dumps(value, option=ORJSON_OPTIONS)
+    return stdlib_dumps(value)
+
+
+def stdlib_dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=_default).encode()
+
+
+def loads(payload):
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
@@ -0,0 +1,131 @@
+"""
+Effective seismic weight per tributary area.
+
+Joins the analyzer's wall lengths and floor/roof areas with the unit weights of each page's
+EFFECTIVE SEISMIC WEIGHT CRITERIA in one vectorized pass over every page:
+- walls: Weight (psf) x Height (ft) x length (ft)
+- floors: Weight (psf) x area (sf)
+- roofs: Weight (psf) x area (sf), plus SNOW_FRACTION of the Snow load where it exceeds
+  SNOW_THRESHOLD_PSF (ASCE 7-16 12.7.2)
+Weights are in pounds. Elements whose label has no criteria on the page get a null weight and
+count as zero in the area totals.
+"""
+import io
+from importlib.util import find_spec
+import numpy as np
+import pandas as pd
+
+# element kind, quantity key of the area analysis, section of the weight criteria
+ELEMENT_KINDS = (('wall', 'wall_lengths', 'Walls'),
+                 ('floor', 'floor_areas', 'Floors'),
+                 ('roof', 'roof_areas', 'Roofs'))
+
+SNOW_THRESHOLD_PSF = 30.0
+SNOW_FRACTION = 0.2
+
+ELEMENT_COLUMNS = ['page', 'area', 'kind', 'label', 'quantity', 'unit_weight', 'height', 'snow', 'weight']
+AREA_COLUMNS = ['page', 'area', 'wall_weight', 'floor_weight', 'roof_weight', 'total_weight']
+
+FORMATS = ('json', 'csv', 'parquet')
+MIMETYPES = {'json': 'application/json', 'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+def quantities_frame(pages):
+    """One row per page, area, element kind and label with the length or area, from process_pages output."""
+    rows = {'page': [], 'area': [], 'kind': [], 'label': [], 'quantity': []}
+    for page_number, area_analysis in enumerate(pages, 1):
+        for area_label, area in (area_analysis or {}).items():
+            for kind, quantity_key, _ in ELEMENT_KINDS:
+                for label, quantity in area[quantity_key].items():
+                    rows['page'].append(page_number)
+                    rows['area'].append(area_label)
+                    rows['kind'].append(kind)
+                    rows['label'].append(label)
+                    rows['quantity'].append(quantity)
+    return pd.DataFrame(rows).astype({'page': 'int64', 'area': str, 'kind': str, 'label': str,
+                                      'quantity': 'float64'})
+
+
+def criteria_frame(criteria_by_page):
+    """One row per page, element kind and label with its Weight, Height and Snow (NaN when not given)."""
+    rows = {'page': [], 'kind': [], 'label': [], 'unit_weight': [], 'height': [], 'snow': []}
+    for page_number, criteria in criteria_by_page.items():
+        for kind, _, section in ELEMENT_KINDS:
+            for label, values in (criteria or {}).get(section, {}).items():
+                rows['page'].append(page_number)
+                rows['kind'].append(kind)
+                rows['label'].append(label)
+                rows['unit_weight'].append(values.get('Weight', np.nan))
+                rows['height'].append(values.get('Height', np.nan))
+                rows['snow'].append(values.get('Snow', np.nan))
+    return pd.DataFrame(rows).astype({'page': 'int64', 'kind': str, 'label': str, 'unit_weight': 'float64',
+                                      'height': 'float64', 'snow': 'float64'})
+
+
+def element_weights(pages, criteria_by_page):
+    """
+    Seismic weight of every element label in every area.
+    pages is the process_pages output and criteria_by_page maps 1-based page numbers to the parsed
+    weight criteria of that page.
+    """
+    elements = quantities_frame(pages).merge(
+        criteria_frame(criteria_by_page), on=['page', 'kind', 'label'], how='left')
+
+    kind = elements['kind'].to_numpy()
+    quantity = elements['quantity'].to_numpy()
+    unit_weight = elements['unit_weight'].to_numpy()
+    snow = elements['snow'].fillna(0.0).to_numpy()
+    snow_weight = np.where(snow > SNOW_THRESHOLD_PSF, SNOW_FRACTION * snow, 0.0)
+    elements['weight'] = np.select(
+        [kind == 'wall', kind == 'roof'],
+        [unit_weight * elements['height'].to_numpy() * quantity, (unit_weight + snow_weight) * quantity],
+        unit_weight * quantity)
+    return elements[ELEMENT_COLUMNS]
+
+
+def area_weights(elements, pages):
+    """Total seismic weight per area and element kind, one row per area in page order."""
+    areas = pd.DataFrame([(page_number, area_label)
+                          for page_number, area_analysis in enumerate(pages, 1)
+                          for area_label in (area_analysis or {})],
+                         columns=['page', 'area']).astype({'page': 'int64', 'area': str})
+    totals = elements.pivot_table(index=['page', 'area'], columns='kind', values='weight',
+                                  aggfunc='sum', fill_value=0.0)
+    totals = totals.reindex(columns=[kind for kind, _, _ in ELEMENT_KINDS], fill_value=0.0)
+    totals.columns = [f'{kind}_weight' for kind in totals.columns]
+    totals = areas.merge(totals.reset_index(), on=['page', 'area'], how='left').fillna(0.0)
+    totals['total_weight'] = totals['wall_weight'] + totals['floor_weight'] + totals['roof_weight']
+    return totals[AREA_COLUMNS]
+
+
+def seismic_weights(pages, criteria_by_page, by='area'):
+    """The area totals (by="area") or the per element rows (by="element") as a DataFrame."""
+    elements = element_weights(pages, criteria_by_page)
+    if by == 'element':
+        return elements
+    if by == 'area':
+        return area_weights(elements, pages)
+    raise ValueError(f"Unknown grouping '{by}', expected area or element")
+
+
+def parquet_available():
+    return find_spec('pyarrow') is not None or find_spec('fastparquet') is not None
+
+
+def serialize(frame, output_format='json'):
+    """
+    Encode the table as JSON records, CSV or Parquet bytes.
+    Parquet needs pyarrow (or fastparquet), which isn't installed by default.
+    """
+    if output_format == 'json':
+        return frame.to_json(orient='records').encode()
+    if output_format == 'csv':
+        return frame.to_csv(index=False).encode()
+    if output_format == 'parquet':
+        output = io.BytesIO()
+        try:
+            frame.to_parquet(output, index=False)
+        except ImportError as e:
+            raise ValueError(f"Parquet output is not available: {e}") from None
+        return output.getvalue()
+    raise ValueError(f"Unknown format '{output_format}', expected one of {', '.join(FORMATS)}")